@@ -1,11 +1,33 @@
+import abc
 import base64
+import contextlib
+import hashlib
+import io
+import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import html
 import re
+import string
+import itertools
 import time
+import threading
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 import google.generativeai as genai
-from flask import Flask, Response, request
+try:
+    from PIL import Image  # Pillow, optional: without it images are embedded as downloaded
+except ImportError:
+    Image = None
+try:
+    import websocket  # websocket-client, optional: presence falls back to REST polling
+except ImportError:
+    websocket = None
+from flask import Flask, Response, request, jsonify, g
+from werkzeug.datastructures import MultiDict
 
 app = Flask(__name__)
 
@@ -16,10 +38,654 @@ GOOGLE_API_KEY = os.environ.get("GEMINI_API_KEY")
 if GOOGLE_API_KEY:
     genai.configure(api_key=GOOGLE_API_KEY)
 
-CACHE = {} 
+# Seconds each cache namespace is kept before it is refetched
+CACHE_TTL = {
+    "ai": 3600,     # Gemini status lines
+    "ai_last": 86400,  # Last good line per user, served while a fresh one is generated
+    "json": 10,     # Upstream API payloads, see SOURCE_TTL for per-source freshness
+    "img": 21600,   # Image metadata per URL (etag, last-modified, content hash)
+    "blob": 21600,  # Encoded image data URIs, keyed by content hash
+    "svg": 30,      # Fully rendered badges (overridden per badge type by CACHE_POLICY)
+}
+# Browser / camo caching per badge type: (max-age, stale-while-revalidate)
+CACHE_POLICY = {
+    "user": (10, 30),       # Lanyard presence moves fast
+    "discord": (300, 600),  # Server member counts
+    "github": (600, 3600),  # Repo / profile stats
+}
+# Freshness window per upstream source (seconds)
+SOURCE_TTL = {
+    "lanyard": 5,    # Live presence
+    "discord": 300,  # Invite member counts
+    "github": 600,   # Repo / profile stats
+}
+PROGRESS_STEP = CACHE_POLICY["user"][0]  # Seconds per Spotify progress bar step, one per browser max-age
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 4096))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# "memory" = per worker only, "sqlite" = memory in front of one file shared by all workers on the host
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory").lower()
+# Default lives in a private (0700) per-user directory, never a predictable name in the shared temp dir
+CACHE_PATH = os.environ.get("CACHE_PATH", os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "hyperbadge", "cache.sqlite3"))
+CACHE_SHARED_MAX_ENTRIES = int(os.environ.get("CACHE_SHARED_MAX_ENTRIES", 20000))
+
+# Background Lanyard presence for recently requested user IDs
+PRESENCE_WS_URL = os.environ.get("PRESENCE_WS_URL", "wss://api.lanyard.rest/socket")
+PRESENCE_IDLE = 600        # Stop tracking an ID after this long without a badge request
+PRESENCE_MAX_IDS = 1000    # Cap on tracked IDs, extra IDs are simply fetched per request
+PRESENCE_POLL = 15         # REST polling interval when the WebSocket is unavailable
+PRESENCE_POLL_MAX = 50     # Most recently requested IDs polled per interval, the rest are fetched per request
+PRESENCE_POLL_WORKERS = 4  # Own small pool, so polling never competes with badge fan-out on POOL
+PRESENCE_RESUBSCRIBE = 10  # Min seconds between WebSocket resubscribes for new IDs
+
+# Gemini generation queue
+AI_RATE = float(os.environ.get("AI_RATE", 1.0))  # generate_content calls per second (token bucket)
+AI_BURST = 5        # Calls allowed back to back after an idle spell
+AI_BATCH = 8        # Prompts folded into one generate_content call
+AI_QUEUE_MAX = 256  # Pending prompts beyond this are dropped
+AI_WAIT = 2.0       # How long a request with no previous line waits for a fresh one
+AI_FAIL_TTL = 60    # Seconds a failed prompt is remembered before Gemini is asked again
+
+# /badges batch endpoint
+BATCH_MAX = 50     # Badges per batch request
+BATCH_WORKERS = 8  # Badges built in parallel (own pool: each one fans out on POOL)
+BATCH_GAP = 10     # px between cells of the composed grid
+
+# Per-request budget for the avatar / album art / AI fan-out (seconds)
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", 3.0))
+FANOUT_WORKERS = int(os.environ.get("FANOUT_WORKERS", 16))
+
+IMAGE_FRESH = 600  # Seconds before a stored image is revalidated upstream
+IMAGE_SCALE = float(os.environ.get("IMAGE_SCALE", 2))  # Embedded pixels per drawn pixel (HiDPI)
+IMAGE_QUALITY = 80  # JPEG quality for re-encoded avatars / album art
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR")  # Optional, keeps images warm across restarts
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024))  # Disk budget for IMAGE_CACHE_DIR
+IMAGE_CACHE_MAX_AGE = 7 * 86400  # Files not written or read from disk in this long are removed
+
 HEADERS = {'User-Agent': 'HyperBadge/Stable-v31'}
+TIMEOUT = (2, 4)  # (connect, read) seconds
+RETRY_AFTER_MAX = 1.0  # Never sleep longer than this on a 429/503 Retry-After
+# Keep-alive connections kept per upstream host, everything else uses 10
+POOL_SIZES = {
+    "https://api.lanyard.rest": 32,
+    "https://cdn.discordapp.com": 32,
+    "https://i.scdn.co": 16,
+    "https://discord.com": 8,
+    "https://api.github.com": 8,
+    "https://avatars.githubusercontent.com": 8,
+}
+# Adds a Server-Timing header (per-stage ms) to badge responses, visible in browser devtools
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "false").lower() == "true"
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)  # seconds
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576)  # bytes
+
 EMPTY = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
 
+# ===========================
+#          METRICS
+# ===========================
+
+class Metrics:
+    """
+    In-process counters and histograms, served in Prometheus text format by /metrics.
+    Per worker: with several gunicorn workers a scrape sees the worker that answered it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = {}        # name -> (type, help, buckets)
+        self.values = {}      # (name, labels) -> counter value, or [bucket counts..., sum, count]
+        self.scraped = {}     # name -> fn returning [(labels, value)], read at scrape time
+
+    def counter(self, name, help, fn=None):
+        """fn, if given, reads a running total kept elsewhere at scrape time instead of inc()."""
+        self.meta[name] = ("counter", help, None)
+        if fn: self.scraped[name] = fn
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        self.meta[name] = ("histogram", help, buckets)
+
+    def gauge(self, name, help, fn):
+        self.meta[name] = ("gauge", help, None)
+        self.scraped[name] = fn
+
+    def inc(self, name, n=1, **labels):
+        k = (name, tuple(sorted((l, str(v)) for l, v in labels.items())))
+        with self.lock: self.values[k] = self.values.get(k, 0) + n
+
+    def observe(self, name, value, **labels):
+        k = (name, tuple(sorted((l, str(v)) for l, v in labels.items())))
+        buckets = self.meta[name][2]
+        with self.lock:
+            h = self.values.get(k)
+            if h is None: h = self.values[k] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound: h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, timings=None, **labels):
+        """Observes the block's duration, and adds it to timings[stage label] for Server-Timing."""
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            took = time.perf_counter() - t
+            self.observe(name, took, **labels)
+            if timings is not None: timings[labels["stage"]] = timings.get(labels["stage"], 0) + took
+
+    def render(self):
+        with self.lock: values = {k: list(v) if isinstance(v, list) else v for k, v in self.values.items()}
+        series = {}
+        for (name, labels), v in values.items(): series.setdefault(name, []).append((labels, v))
+        for name, fn in self.scraped.items():
+            try: series[name] = [(tuple(sorted((l, str(x)) for l, x in labels.items())), v) for labels, v in fn()]
+            except Exception: continue
+        fmt = lambda labels: "{" + ",".join(f'{l}="{v}"' for l, v in labels) + "}" if labels else ""
+        out = []
+        for name, (kind, help, buckets) in self.meta.items():
+            out += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            for labels, v in sorted(series.get(name, [])):
+                if kind != "histogram":
+                    out.append(f"{name}{fmt(labels)} {v}")
+                    continue
+                for bound, n in zip(buckets + ("+Inf",), v[:-2] + [v[-1]]):
+                    out.append(f"{name}_bucket{fmt(labels + (('le', str(bound)),))} {n}")
+                out += [f"{name}_sum{fmt(labels)} {v[-2]}", f"{name}_count{fmt(labels)} {v[-1]}"]
+        return "\n".join(out) + "\n"
+
+METRICS = Metrics()
+METRICS.counter("badge_http_requests_total", "HTTP responses by endpoint and status code.")
+METRICS.histogram("badge_http_request_seconds", "Wall time per HTTP request by endpoint.")
+METRICS.histogram("badge_response_bytes", "Badge SVG body size by badge type.", SIZE_BUCKETS)
+METRICS.histogram("badge_stage_seconds", "Time per badge build stage (upstream, output_cache, avatar, art, ai, css, render).")
+METRICS.histogram("badge_render_seconds", "Renderer time by style.")
+METRICS.counter("badge_errors_total", "Badges that fell back to the error SVG, by stage and exception type.")
+METRICS.counter("badge_fanout_fallbacks_total", "Fan-out jobs replaced by their fallback, by job and reason.")
+METRICS.counter("badge_cache_requests_total", "Cache lookups by tier, namespace and result.")
+METRICS.histogram("badge_upstream_seconds", "Upstream HTTP call time by source.")
+METRICS.counter("badge_upstream_responses_total", "Upstream HTTP responses by source and status code.")
+METRICS.counter("badge_upstream_errors_total", "Upstream HTTP calls that raised (timeouts, connection errors), by source and type.")
+METRICS.histogram("badge_ai_call_seconds", "Gemini generate_content call time.")
+METRICS.counter("badge_ai_errors_total", "Failed Gemini calls by exception type.")
+
+# ===========================
+#         HTTP CLIENT
+# ===========================
+
+class CappedRetry(Retry):
+    """Honours Retry-After, but caps the wait so a badge is never held hostage by it."""
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, RETRY_AFTER_MAX)
+
+def make_session():
+    retry = CappedRetry(
+        # Only 429/5xx answers are retried (plus one quick reconnect): a read timeout means the
+        # upstream is already struggling, and retrying it would multiply the wait and the load
+        total=2, read=False, connect=1, backoff_factor=0.2, status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",), respect_retry_after_header=True, raise_on_status=False,
+    )
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=10, max_retries=retry))
+    for host, size in POOL_SIZES.items():
+        session.mount(host, HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=retry))
+    return session
+
+HTTP = make_session()
+
+def pool_stats():
+    """Per-host connection pool usage of the shared session."""
+    stats = {}
+    for adapter in set(HTTP.adapters.values()):
+        # Snapshot: requests on other threads add and evict pools while we read
+        for pool in list(adapter.poolmanager.pools._container.values()):
+            stats[f"{pool.scheme}://{pool.host}"] = {
+                "connections": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle": sum(1 for conn in list(pool.pool.queue) if conn) if pool.pool else 0,
+                "maxsize": pool.pool.maxsize if pool.pool else 0,
+            }
+    return stats
+
+# ===========================
+#           CACHE
+# ===========================
+
+_MISS = object()
+
+class CacheBackend(abc.ABC):
+    """
+    Interface every cache backend implements (get and set are required).
+    Keys live in a namespace (see CACHE_TTL), ttl=None means the namespace default.
+    Caches are best effort: backends swallow their own storage errors and report a miss.
+    """
+    @abc.abstractmethod
+    def get(self, ns, key, default=None): ...
+
+    @abc.abstractmethod
+    def set(self, ns, key, value, ttl=None): ...
+
+    def snapshot(self): return {}
+
+class TTLCache(CacheBackend):
+    """
+    In-process backend: thread-safe LRU cache with per-namespace TTLs.
+    Bounded by entry count AND approximate byte size, oldest entries go first.
+    """
+    def __init__(self, ttls, max_entries=4096, max_bytes=64 * 1024 * 1024):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()  # (ns, key) -> (expires_at, size, value)
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    @staticmethod
+    def _size(value):
+        if isinstance(value, (str, bytes)): return len(value)
+        if isinstance(value, tuple): return sum(map(TTLCache._size, value))
+        return len(repr(value))
+
+    def _drop(self, k):
+        _, size, _ = self.data.pop(k)
+        self.bytes -= size
+
+    def get(self, ns, key, default=None):
+        k = (ns, key)
+        with self.lock:
+            item = self.data.get(k)
+            if item is not None and item[0] < time.time():
+                self._drop(k)
+                self.stats["expired"] += 1
+                item = None
+            self.stats["misses" if item is None else "hits"] += 1
+            if item is not None: self.data.move_to_end(k)
+        METRICS.inc("badge_cache_requests_total", tier="memory", ns=ns, result="miss" if item is None else "hit")
+        return default if item is None else item[2]
+
+    def set(self, ns, key, value, ttl=None):
+        k = (ns, key)
+        ttl = self.ttls.get(ns, 60) if ttl is None else ttl
+        size = self._size(value)
+        if size > self.max_bytes: return
+        with self.lock:
+            if k in self.data: self._drop(k)
+            self.data[k] = (time.time() + ttl, size, value)
+            self.bytes += size
+            while len(self.data) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self.data)))
+                self.stats["evictions"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.data), bytes=self.bytes)
+
+class SQLiteCache(CacheBackend):
+    """
+    Shared backend: one SQLite file (WAL mode) on local disk, used by every gunicorn
+    worker on the host and surviving worker recycling.
+    Values are stored as JSON (bytes base64 encoded, tuples come back as lists), never
+    pickled, and every write is a single atomic INSERT OR REPLACE.
+    An unusable path just makes every call a counted miss.
+    """
+    def __init__(self, path, ttls, max_entries=20000):
+        self.path = path
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "errors": 0}
+        try: self._db()
+        except sqlite3.Error: self._count("errors")
+
+    def _db(self):
+        # One connection per thread, and never reuse one inherited across a fork
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            try:
+                folder = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(folder, mode=0o700, exist_ok=True)
+                st = os.stat(folder)
+                if st.st_uid != os.getuid() or st.st_mode & 0o022:
+                    raise sqlite3.OperationalError(f"{folder} is writable by other users")
+            except OSError as e:
+                raise sqlite3.OperationalError(str(e))
+            conn = sqlite3.connect(self.path, timeout=2, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (ns TEXT, key TEXT, expires REAL, value TEXT, PRIMARY KEY (ns, key))")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    @staticmethod
+    def _dumps(value):
+        def bytes_as_b64(v):
+            if isinstance(v, bytes): return {"__b64__": base64.b64encode(v).decode()}
+            raise TypeError(f"{type(v).__name__} is not cacheable")
+        return json.dumps(value, default=bytes_as_b64, separators=(",", ":"))
+
+    @staticmethod
+    def _loads(text):
+        return json.loads(text, object_hook=lambda o: base64.b64decode(o["__b64__"]) if len(o) == 1 and "__b64__" in o else o)
+
+    def _count(self, stat, n=1):
+        with self.lock: self.stats[stat] += n
+
+    def get_entry(self, ns, key):
+        """(expires_at, value) or None."""
+        try:
+            row = self._db().execute("SELECT expires, value FROM cache WHERE ns = ? AND key = ?", (ns, str(key))).fetchone()
+            if row and row[0] >= time.time():
+                entry = row[0], self._loads(row[1])
+                self._count("hits")
+                METRICS.inc("badge_cache_requests_total", tier="sqlite", ns=ns, result="hit")
+                return entry
+        except (sqlite3.Error, ValueError, TypeError):
+            self._count("errors")
+        self._count("misses")
+        METRICS.inc("badge_cache_requests_total", tier="sqlite", ns=ns, result="miss")
+        return None
+
+    def get(self, ns, key, default=None):
+        entry = self.get_entry(ns, key)
+        return default if entry is None else entry[1]
+
+    def set(self, ns, key, value, ttl=None):
+        ttl = self.ttls.get(ns, 60) if ttl is None else ttl
+        try:
+            text = self._dumps(value)
+            self._db().execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (ns, str(key), time.time() + ttl, text))
+        except (sqlite3.Error, ValueError, TypeError):
+            self._count("errors")
+            return
+        with self.lock:
+            self.writes += 1
+            sweep = self.writes % 500 == 0
+        if sweep: self._sweep()
+
+    def _sweep(self):
+        """Drops expired rows, then the soonest-to-expire ones while over max_entries."""
+        try:
+            db = self._db()
+            gone = db.execute("DELETE FROM cache WHERE expires < ?", (time.time(),)).rowcount
+            over = db.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+            if over > 0:
+                gone += db.execute("DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY expires LIMIT ?)", (over,)).rowcount
+            self._count("evictions", gone)
+        except sqlite3.Error:
+            self._count("errors")
+
+    def snapshot(self):
+        with self.lock: stats = dict(self.stats)
+        try: stats["entries"] = self._db().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        except sqlite3.Error: pass
+        return stats
+
+class TieredCache(CacheBackend):
+    """
+    Per-worker memory in front of a shared backend.
+    Hot keys are served from memory; memory misses read the shared store and keep a
+    local copy for the rest of its TTL. Writes go to both.
+    """
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+
+    def get(self, ns, key, default=None):
+        value = self.local.get(ns, key, _MISS)
+        if value is not _MISS: return value
+        entry = self.shared.get_entry(ns, key)
+        if entry is None: return default
+        self.local.set(ns, key, entry[1], entry[0] - time.time())
+        return entry[1]
+
+    def set(self, ns, key, value, ttl=None):
+        self.local.set(ns, key, value, ttl)
+        self.shared.set(ns, key, value, ttl)
+
+    def snapshot(self):
+        return {"local": self.local.snapshot(), "shared": self.shared.snapshot()}
+
+def make_cache():
+    local = TTLCache(CACHE_TTL, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+    if CACHE_BACKEND == "sqlite":
+        return TieredCache(local, SQLiteCache(CACHE_PATH, CACHE_TTL, CACHE_SHARED_MAX_ENTRIES))
+    return local
+
+CACHE = make_cache()
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one execution.
+    Followers block until the leader finishes and share its result (or error).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"done": threading.Event(), "result": None, "error": None}
+        if not leader:
+            call["done"].wait()
+            if call["error"]: raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = fn(*args)
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock: self.calls.pop(key, None)
+            call["done"].set()
+
+# ===========================
+#        IMAGE STORE
+# ===========================
+
+def image_mime(content):
+    if content[:3] == b"\xff\xd8\xff": return "image/jpeg"
+    if content[:4] == b"GIF8": return "image/gif"
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP": return "image/webp"
+    return "image/png"
+
+def sized_url(url, px):
+    """Asks the CDN for a smaller rendition where it has one."""
+    sep = "&" if "?" in url else "?"
+    if url.startswith("https://cdn.discordapp.com/"):
+        size = 16
+        while size < px and size < 4096: size *= 2  # Discord only serves powers of two
+        return f"{url}{sep}size={size}"
+    if url.startswith("https://avatars.githubusercontent.com/"):
+        return f"{url}{sep}s={px}"
+    if "/image/ab67616d0000b273" in url and px <= 300:
+        return url.replace("ab67616d0000b273", "ab67616d00001e02")  # Spotify 640px art -> 300px
+    return url
+
+def shrink_image(content, px):
+    """
+    Fits an image into a px*px box and re-encodes it: JPEG, or PNG when it has transparency.
+    Returns (mime, bytes), keeping the original whenever that is smaller or unreadable.
+    """
+    original = (image_mime(content), content)
+    if Image is None: return original
+    try:
+        with Image.open(io.BytesIO(content)) as im:
+            if getattr(im, "is_animated", False): return original
+            im.thumbnail((px, px), Image.LANCZOS)
+            out = io.BytesIO()
+            if im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info):
+                im.save(out, "PNG", optimize=True)
+                mime = "image/png"
+            else:
+                im.convert("RGB").save(out, "JPEG", quality=IMAGE_QUALITY, optimize=True)
+                mime = "image/jpeg"
+    except Exception:
+        return original
+    return (mime, out.getvalue()) if out.tell() < len(content) else original
+
+class ImageStore:
+    """
+    Avatar / album art store.
+    URL -> metadata (etag, last-modified, content hash) and hash -> encoded data URI,
+    so an image is downloaded, shrunk and base64 encoded once, then revalidated conditionally.
+    """
+    def __init__(self, cache, disk_dir=None):
+        self.cache = cache
+        self.dir = disk_dir
+        self.flight = SingleFlight()
+        self.lock = threading.Lock()
+        self.stats = {"processed": 0, "bytes_downloaded": 0, "bytes_embedded": 0}
+        self.writes = 0
+        if disk_dir:
+            try:
+                os.makedirs(disk_dir, exist_ok=True)
+                self._sweep()
+            except OSError:
+                self.dir = None  # Unusable directory, keep images in memory only
+
+    def get(self, url, px=None):
+        """Data URI for url, fitted into a px*px box when px is given."""
+        if not url: return EMPTY
+        name = f"{url}@{px}" if px else url
+        meta = self._meta(name)
+        if meta and meta["fresh_until"] > time.time():
+            uri = self._blob(meta["digest"])
+            if uri: return uri
+        try:
+            return self.flight.do(name, self._fetch, name, sized_url(url, px) if px else url, px)
+        except Exception:
+            return EMPTY
+
+    def saved(self, url, px=None):
+        """
+        Bytes re-encoding saved on the embedded copy of url vs inlining the rendition as
+        downloaded (0 if unknown). Savings from asking the CDN for that smaller rendition
+        (sized_url) happen before the download and are not included.
+        """
+        meta = self._meta(f"{url}@{px}" if px else url) if url else None
+        return meta.get("downloaded", 0) - meta.get("embedded", 0) if meta else 0
+
+    def _fetch(self, name, url, px):
+        meta = self._meta(name)
+        uri = self._blob(meta["digest"]) if meta else None
+        headers = {}
+        if uri and meta.get("etag"): headers["If-None-Match"] = meta["etag"]
+        if uri and meta.get("modified"): headers["If-Modified-Since"] = meta["modified"]
+        host = url.split('/')[2]
+        try:
+            with METRICS.timer("badge_upstream_seconds", source=host):
+                r = HTTP.get(url, headers=headers, timeout=TIMEOUT)
+        except Exception as e:
+            METRICS.inc("badge_upstream_errors_total", source=host, error=type(e).__name__)
+            return uri or EMPTY  # Serve stale over nothing
+        METRICS.inc("badge_upstream_responses_total", source=host, code=r.status_code)
+        if r.status_code == 304 and uri:
+            meta["fresh_until"] = time.time() + IMAGE_FRESH
+            self._save_meta(name, meta)
+            return uri
+        if r.status_code != 200: return uri or EMPTY
+
+        digest = hashlib.sha256(r.content).hexdigest()
+        if px: digest += f"@{px}"
+        uri = self._blob(digest)
+        if not uri:
+            mime, body = shrink_image(r.content, px) if px else (image_mime(r.content), r.content)
+            uri = f"data:{mime};base64,{base64.b64encode(body).decode('utf-8')}"
+            self._save_blob(digest, uri)
+        # Inlining the downloaded rendition as is vs what is embedded after re-encoding
+        downloaded = len("data:image/png;base64,") + 4 * ((len(r.content) + 2) // 3)
+        with self.lock:
+            self.stats["processed"] += 1
+            self.stats["bytes_downloaded"] += downloaded
+            self.stats["bytes_embedded"] += len(uri)
+        self._save_meta(name, {
+            "digest": digest,
+            "etag": r.headers.get("ETag"),
+            "modified": r.headers.get("Last-Modified"),
+            "fresh_until": time.time() + IMAGE_FRESH,
+            "downloaded": downloaded,
+            "embedded": len(uri),
+        })
+        return uri
+
+    # --- Storage (memory first, then optional disk) ---
+
+    def _path(self, name):
+        return os.path.join(self.dir, name)
+
+    def _meta(self, url):
+        meta = self.cache.get("img", url)
+        if meta or not self.dir: return meta
+        try:
+            with open(self._path(hashlib.sha256(url.encode()).hexdigest() + ".json")) as f:
+                meta = json.load(f)
+            meta["fresh_until"] = 0  # Unknown age after a restart, revalidate first
+            self.cache.set("img", url, meta)
+            return meta
+        except (OSError, ValueError):
+            return None
+
+    def _blob(self, digest):
+        uri = self.cache.get("blob", digest)
+        if uri or not self.dir: return uri
+        try:
+            with open(self._path(digest + ".uri")) as f:
+                uri = f.read()
+            os.utime(self._path(digest + ".uri"))  # Mark as used for _sweep
+            self.cache.set("blob", digest, uri)
+            return uri
+        except OSError:
+            return None
+
+    def _write(self, name, text):
+        tmp = self._path(f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "w") as f: f.write(text)
+            os.replace(tmp, self._path(name))
+        except OSError:
+            return
+        with self.lock:
+            self.writes += 1
+            sweep = self.writes % 200 == 0
+        if sweep: self._sweep()
+
+    def _sweep(self):
+        """Drops disk files idle for IMAGE_CACHE_MAX_AGE, then the least recently used while over IMAGE_CACHE_MAX_BYTES."""
+        try:
+            files = []
+            for entry in os.scandir(self.dir):
+                try:
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, entry.path))
+                except OSError: continue  # Removed by another worker
+        except OSError:
+            return
+        cutoff, total = time.time() - IMAGE_CACHE_MAX_AGE, sum(f[1] for f in files)
+        for mtime, size, path in sorted(files):
+            if mtime >= cutoff and total <= IMAGE_CACHE_MAX_BYTES: break
+            try: os.remove(path)
+            except OSError: pass
+            total -= size
+
+    def _save_meta(self, url, meta):
+        self.cache.set("img", url, meta)
+        if self.dir: self._write(hashlib.sha256(url.encode()).hexdigest() + ".json", json.dumps(meta))
+
+    def _save_blob(self, digest, uri):
+        self.cache.set("blob", digest, uri)
+        if self.dir: self._write(digest + ".uri", uri)
+
+IMAGES = ImageStore(CACHE, IMAGE_CACHE_DIR)
+
 # ===========================
 #      HELPER FUNCTIONS
 # ===========================
@@ -31,23 +697,63 @@ def sanitize_xml(text):
     text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', text)
     return html.escape(text, quote=True)
 
-def get_base64(url):
-    if not url: return EMPTY
-    try:
-        r = requests.get(url, headers=HEADERS, timeout=4)
-        if r.status_code == 200:
-            return f"data:image/png;base64,{base64.b64encode(r.content).decode('utf-8')}"
-    except:
-        pass
-    return EMPTY
+def get_base64(url, px=None):
+    return IMAGES.get(url, px)
 
-def get_css(master_anim, bg_anim, fg_anim):
+UPSTREAM = SingleFlight()
+POOL = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+
+def _timed_job(name, timings, fn, *args):
+    with METRICS.timer("badge_stage_seconds", timings, stage=name):
+        return fn(*args)
+
+def gather(jobs, deadline, timings=None):
     """
-    FIXED SIGNATURE: Accepts 3 arguments now.
+    Runs independent jobs concurrently on POOL.
+    jobs: {name: (fn, args, fallback)}. Anything failed or unfinished at the deadline
+    gets its fallback; stragglers keep running and still warm the caches.
+    Returns (results, complete) where complete is False if any fallback was used.
+    Each job's duration is observed as a badge stage (and kept in timings when given).
     """
-    css = "@import url('https://fonts.googleapis.com/css2?family=JetBrains+Mono:wght@800&amp;family=Rajdhani:wght@600;800&amp;family=Outfit:wght@500;900&amp;family=Pacifico&amp;family=Fredoka:wght@500;700&amp;family=Fira+Code:wght@500&amp;display=swap');"
-    
-    keyframes = """
+    futures = {name: POOL.submit(_timed_job, name, timings, fn, *args) for name, (fn, args, _) in jobs.items()}
+    wait(futures.values(), timeout=max(deadline - time.time(), 0))
+    out, complete = {}, True
+    for name, fut in futures.items():
+        try:
+            if not fut.done(): raise TimeoutError
+            out[name] = fut.result(timeout=0)
+        except Exception as e:
+            METRICS.inc("badge_fanout_fallbacks_total", job=name, reason="deadline" if isinstance(e, TimeoutError) else type(e).__name__)
+            out[name], complete = jobs[name][2], False
+    return out, complete
+
+def fetch_json(url, source):
+    """
+    GET + decode an upstream API payload.
+    Concurrent requests for the same URL share one upstream call, and successful
+    responses are reused for the source's freshness window (SOURCE_TTL).
+    """
+    hit = CACHE.get("json", url)
+    if hit is not None: return hit
+    return UPSTREAM.do(url, _fetch_json, url, source)
+
+def _fetch_json(url, source):
+    hit = CACHE.get("json", url)  # A previous leader may have just filled it
+    if hit is not None: return hit
+    try:
+        with METRICS.timer("badge_upstream_seconds", source=source):
+            r = HTTP.get(url, timeout=TIMEOUT)
+    except Exception as e:
+        METRICS.inc("badge_upstream_errors_total", source=source, error=type(e).__name__)
+        raise
+    METRICS.inc("badge_upstream_responses_total", source=source, code=r.status_code)
+    d = r.json()
+    if r.status_code == 200: CACHE.set("json", url, d, SOURCE_TTL.get(source))
+    return d
+
+CSS_IMPORT = "@import url('https://fonts.googleapis.com/css2?family=JetBrains+Mono:wght@800&amp;family=Rajdhani:wght@600;800&amp;family=Outfit:wght@500;900&amp;family=Pacifico&amp;family=Fredoka:wght@500;700&amp;family=Fira+Code:wght@500&amp;display=swap');"
+
+CSS_KEYFRAMES = """
     @keyframes m1 { 0%{cx:10px; cy:10px} 50%{cx:300px; cy:80px} 100%{cx:10px; cy:10px} }
     @keyframes m2 { 0%{cx:400px; cy:100px} 50%{cx:100px; cy:20px} 100%{cx:400px; cy:100px} }
     @keyframes d { from{transform:rotate(0deg) scale(1.1)} to{transform:rotate(360deg) scale(1.1)} }
@@ -61,46 +767,299 @@ def get_css(master_anim, bg_anim, fg_anim):
     @keyframes curs { 50% { opacity: 0 } }
     """
 
+# Foreground Animations
+CSS_FG = ".float{animation:f 6s ease-in-out infinite} .pulse{animation:p 2s infinite} .bob{animation:b 3s ease-in-out infinite} .hover-panel{animation:hov 8s ease-in-out infinite} .hover-panel-2{animation:hov 8s ease-in-out infinite reverse} .cursor{animation:curs 1s step-end infinite}"
+
+# Background Animations
+CSS_BG = ".mesh-1{animation:m1 30s infinite ease-in-out} .mesh-2{animation:m2 40s infinite ease-in-out} .drift{animation:d 40s linear infinite;transform-origin:center} .scroll-bg{animation:s 20s linear infinite} .scanline{animation:sl 4s linear infinite} .flow-border{animation:bf 4s linear infinite;stroke-dasharray:200}"
+
+def _build_css(m_on, bg_on, fg_on):
+    if not m_on: return CSS_IMPORT + CSS_KEYFRAMES + " * { animation: none !important; transition: none !important; }"
+    return CSS_IMPORT + CSS_KEYFRAMES + (CSS_FG if fg_on else "") + (CSS_BG if bg_on else "")
+
+# Only 2^3 flag combinations exist, so every variant is built (and encoded) once at import
+CSS_VARIANTS = {flags: _build_css(*flags).encode() for flags in itertools.product((True, False), repeat=3)}
+
+def get_css(master_anim, bg_anim, fg_anim):
+    """
+    FIXED SIGNATURE: Accepts 3 arguments now.
+    Returns the pre-built (bytes) stylesheet for the flag combination.
+    """
     m_on = str(master_anim).lower() == 'true'
     bg_on = str(bg_anim).lower() == 'true' and m_on
     fg_on = str(fg_anim).lower() == 'true' and m_on
-
-    if not m_on: return css + keyframes + " * { animation: none !important; transition: none !important; }"
-
-    classes = ""
-    # Foreground Animations
-    if fg_on:
-        classes += ".float{animation:f 6s ease-in-out infinite} .pulse{animation:p 2s infinite} .bob{animation:b 3s ease-in-out infinite} .hover-panel{animation:hov 8s ease-in-out infinite} .hover-panel-2{animation:hov 8s ease-in-out infinite reverse} .cursor{animation:curs 1s step-end infinite}"
-    
-    # Background Animations
-    if bg_on:
-        classes += ".mesh-1{animation:m1 30s infinite ease-in-out} .mesh-2{animation:m2 40s infinite ease-in-out} .drift{animation:d 40s linear infinite;transform-origin:center} .scroll-bg{animation:s 20s linear infinite} .scanline{animation:sl 4s linear infinite} .flow-border{animation:bf 4s linear infinite;stroke-dasharray:200}"
-        
-    return css + keyframes + classes
+    return CSS_VARIANTS[(m_on, bg_on, fg_on)]
 
 # ===========================
 #        AI LOGIC
 # ===========================
 
+def ai_prompt(status_text, user_name, mode):
+    if mode == "roast":
+        return f"Roast '{user_name}' about '{status_text}'. Savage. Uppercase. Max 6 words."
+    return f"System status for '{user_name}' who is '{status_text}'. Tech HUD style. Uppercase. Max 6 words."
+
+def clean_ai(text):
+    return sanitize_xml(text.strip().replace('"','')).upper()[:45]
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, with bursts of up to `burst`."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Blocks until a token is available."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class AIQueue:
+    """
+    Gemini off the request path.
+    Prompts are queued (deduped per name/status/mode) and a background thread folds up to
+    `batch` of them into one rate-limited generate_content call on a reused model client.
+    Requests get the cached line, else the user's last line while a fresh one is made;
+    ask() says which, so stand-in lines never end up in the rendered badge cache.
+    A failed prompt is cached empty for AI_FAIL_TTL, so an outage doesn't requeue it on every request.
+    """
+    def __init__(self, model_factory, rate=1.0, burst=5, batch=8, max_pending=256):
+        self.model_factory = model_factory
+        self.model = None
+        self.bucket = TokenBucket(rate, burst)
+        self.batch = batch
+        self.max_pending = max_pending
+        self.pending = OrderedDict()  # key -> item, waiting for a batch
+        self.inflight = {}            # key -> item, being generated
+        self.cond = threading.Condition()
+        self.thread = None
+        self.stats = {"calls": 0, "prompts": 0, "errors": 0, "dropped": 0}
+
+    def ask(self, status_text, user_name, mode, wait=0):
+        """
+        (line, fresh): fresh is False for the last line or a timeout (None) while a line is queued.
+        A recent failure is settled: the last line, else "SECURE".
+        """
+        key = f"{user_name}_{status_text}_{mode}"
+        hit = CACHE.get("ai", key)
+        last = CACHE.get("ai_last", f"{user_name}_{mode}")
+        if hit is not None: return hit or last or "SECURE", True
+        item = self._enqueue(key, (status_text, user_name, mode))
+        if last or item is None: return last, False
+        item["done"].wait(wait)
+        if item["text"]: return item["text"], True
+        return ("SECURE", True) if item["failed"] else (None, False)
+
+    def _enqueue(self, key, args):
+        with self.cond:
+            item = self.pending.get(key) or self.inflight.get(key)
+            if item: return item
+            if len(self.pending) >= self.max_pending:
+                self.stats["dropped"] += 1
+                return None
+            item = self.pending[key] = {"key": key, "args": args, "done": threading.Event(), "text": None, "failed": False}
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="ai", daemon=True)
+                self.thread.start()
+            self.cond.notify()
+            return item
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending: self.cond.wait()
+            self.bucket.take()
+            with self.cond:
+                items = [self.pending.popitem(last=False)[1] for _ in range(min(self.batch, len(self.pending)))]
+                for item in items: self.inflight[item["key"]] = item
+            try:
+                self._generate(items)
+            finally:
+                with self.cond:
+                    for item in items: self.inflight.pop(item["key"], None)
+                for item in items: item["done"].set()
+
+    def _generate(self, items):
+        try:
+            if self.model is None: self.model = self.model_factory()
+            self.stats["calls"] += 1
+            self.stats["prompts"] += len(items)
+            if len(items) == 1:
+                with METRICS.timer("badge_ai_call_seconds"):
+                    lines = {1: self.model.generate_content(ai_prompt(*items[0]["args"])).text}
+            else:
+                prompt = (f"Answer each numbered request with one line formatted '<number>: <answer>'. "
+                          f"Exactly {len(items)} lines, nothing else.\n")
+                prompt += "\n".join(f"{i}: {ai_prompt(*item['args'])}" for i, item in enumerate(items, 1))
+                with METRICS.timer("badge_ai_call_seconds"):
+                    text = self.model.generate_content(prompt).text
+                lines = {}
+                for line in text.splitlines():
+                    m = re.match(r"\s*(\d+)\s*[:.)-]\s*(.+)", line)
+                    if m: lines[int(m.group(1))] = m.group(2)
+        except Exception as e:
+            self.stats["errors"] += 1
+            METRICS.inc("badge_ai_errors_total", error=type(e).__name__)
+            lines = {}
+        for i, item in enumerate(items, 1):
+            text = clean_ai(lines[i]) if lines.get(i) else ""
+            if not text:
+                CACHE.set("ai", item["key"], "", AI_FAIL_TTL)
+                item["failed"] = True
+                continue
+            status_text, user_name, mode = item["args"]
+            CACHE.set("ai", item["key"], text)
+            CACHE.set("ai_last", f"{user_name}_{mode}", text)
+            item["text"] = text
+
+AI = AIQueue(lambda: genai.GenerativeModel('gemini-pro'), AI_RATE, AI_BURST, AI_BATCH, AI_QUEUE_MAX)
+
 def consult_gemini(status_text, user_name, mode, enabled):
-    if str(enabled).lower() == 'false': return None
-    if not GOOGLE_API_KEY: return None 
-    
-    key = f"AI_{user_name}_{status_text}_{mode}"
-    if key in CACHE: return CACHE[key]
+    """(msg, fresh), see AIQueue.ask."""
+    if str(enabled).lower() == 'false': return None, True
+    if not GOOGLE_API_KEY: return None, True
+    return AI.ask(status_text, user_name, mode, AI_WAIT)
 
-    try:
-        model = genai.GenerativeModel('gemini-pro')
-        prompt = f"System status for '{user_name}' who is '{status_text}'. Tech HUD style. Uppercase. Max 6 words."
-        if mode == "roast":
-            prompt = f"Roast '{user_name}' about '{status_text}'. Savage. Uppercase. Max 6 words."
-
-        response = model.generate_content(prompt)
-        text = sanitize_xml(response.text.strip().replace('"','')).upper()[:45]
-        CACHE[key] = text
-        return text
-    except:
-        return "SECURE"
+# ===========================
+#      PRESENCE TRACKER
+# ===========================
+
+class PresenceTracker:
+    """
+    Keeps Lanyard presence for recently requested user IDs in memory.
+    A background thread holds one WebSocket subscription for all tracked IDs (or batch
+    polls the REST API when websocket-client is missing / the socket keeps failing),
+    so repeat badge requests read presence without a network hop.
+    Stores the raw Lanyard payload, fetch_data still normalises it per request.
+    """
+    def __init__(self, ws_url):
+        self.ws_url = ws_url
+        self.seen = {}      # user_id -> last requested
+        self.presence = {}  # user_id -> (valid_until, lanyard data)
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.thread = None
+        self.poller = ThreadPoolExecutor(max_workers=PRESENCE_POLL_WORKERS, thread_name_prefix="presence-poll")
+
+    def get(self, user_id):
+        """Presence for a tracked user_id if already in sync (and keeps it tracked), else None."""
+        now = time.time()
+        with self.lock:
+            if user_id not in self.seen: return None
+            self.seen[user_id] = now
+            item = self.presence.get(user_id)
+        return item[1] if item and item[0] > now else None
+
+    def track(self, user_id):
+        """Starts following user_id; only call it for IDs Lanyard just answered for."""
+        with self.lock:
+            new = user_id not in self.seen
+            if new and len(self.seen) >= PRESENCE_MAX_IDS: return
+            self.seen[user_id] = time.time()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="presence", daemon=True)
+                self.thread.start()
+        if new: self.changed.set()
+
+    def tracked(self):
+        with self.lock:
+            return sorted(self.seen)
+
+    def _store(self, user_id, data, valid_until):
+        with self.lock:
+            if user_id in self.seen: self.presence[user_id] = (valid_until, data)
+
+    def _prune(self):
+        """Forgets IDs nobody asked for in PRESENCE_IDLE seconds, returns True if any went."""
+        cutoff = time.time() - PRESENCE_IDLE
+        with self.lock:
+            gone = [uid for uid, last in self.seen.items() if last < cutoff]
+            for uid in gone:
+                del self.seen[uid]
+                self.presence.pop(uid, None)
+        return bool(gone)
+
+    # --- Background loop ---
+
+    def _run(self):
+        failures = 0
+        while True:
+            self._prune()
+            if not self.tracked():
+                self.changed.wait(PRESENCE_IDLE)
+                self.changed.clear()
+                continue
+            if websocket is None:
+                self._poll()
+                self.changed.clear()  # New IDs were just fetched by their own request, wait for the next round
+                time.sleep(PRESENCE_POLL)
+                continue
+            try:
+                if self._stream(): failures = 0
+            except Exception:
+                failures += 1
+                with self.lock: self.presence.clear()
+                # Poll through the backoff so tracked badges stay live
+                until = time.time() + min(2 ** failures, 60)
+                while time.time() < until:
+                    self._poll()
+                    time.sleep(PRESENCE_POLL)
+
+    def _poll(self):
+        with self.lock:
+            ids = sorted(self.seen, key=self.seen.get, reverse=True)[:PRESENCE_POLL_MAX]
+        try: futures = [self.poller.submit(fetch_json, f"https://api.lanyard.rest/v1/users/{uid}", "lanyard") for uid in ids]
+        except RuntimeError: return  # Pool shut down (interpreter exiting)
+        for uid, fut in zip(ids, futures):
+            try: d = fut.result(timeout=TIMEOUT[0] + TIMEOUT[1])
+            except Exception: continue
+            if d.get('data'): self._store(uid, d['data'], time.time() + PRESENCE_POLL * 2)
+
+    def _stream(self):
+        """
+        One WebSocket session subscribed to the current IDs.
+        Returns True (after a good session) once the ID set changed and needs resubscribing.
+        """
+        ids = self.tracked()
+        ws = websocket.create_connection(self.ws_url, timeout=TIMEOUT[0] + TIMEOUT[1])
+        try:
+            hello = json.loads(ws.recv())
+            interval = hello['d']['heartbeat_interval'] / 1000
+            ws.send(json.dumps({"op": 2, "d": {"subscribe_to_ids": ids}}))
+            ws.settimeout(1)
+            self.changed.clear()
+            synced, subscribed_at, next_beat = False, time.time(), time.time() + interval
+            while True:
+                try: msg = json.loads(ws.recv())
+                except websocket.WebSocketTimeoutException: msg = None
+                if msg and msg.get('op') == 0:
+                    if msg.get('t') == 'INIT_STATE':
+                        for uid, d in (msg.get('d') or {}).items(): self._store(uid, d, float('inf'))
+                        synced = True
+                    elif msg.get('t') == 'PRESENCE_UPDATE':
+                        d = msg.get('d') or {}
+                        uid = d.get('user_id') or d.get('discord_user', {}).get('id')
+                        if uid: self._store(uid, d, float('inf'))
+                now = time.time()
+                if now >= next_beat:
+                    ws.send(json.dumps({"op": 3}))
+                    next_beat = now + interval
+                if now - subscribed_at >= PRESENCE_RESUBSCRIBE and (self._prune() or self.changed.is_set()):
+                    return synced
+        finally:
+            ws.close()
+
+PRESENCE = PresenceTracker(PRESENCE_WS_URL)
 
 # ===========================
 #       DATA HARVESTERS
@@ -112,10 +1071,9 @@ def fetch_data(key, type_mode, args):
 
         # 1. DISCORD SERVER
         if type_mode == 'discord':
-            r = requests.get(f"https://discord.com/api/v10/invites/{key}?with_counts=true", headers=HEADERS, timeout=4)
-            d = r.json()
+            d = fetch_json(f"https://discord.com/api/v10/invites/{key}?with_counts=true", "discord")
             g = d.get('guild')
-            if not g: return None
+            if not g: raise LookupError("unknown invite")
             
             # Use 'MEMBERS' unless &name=Override is set
             display_title = force_name if force_name else "TOTAL MEMBERS"
@@ -135,43 +1093,45 @@ def fetch_data(key, type_mode, args):
                 "l1": count, 
                 "l2": online,
                 "color": "#5865F2", 
-                "avatar": get_base64(f"https://cdn.discordapp.com/icons/{g['id']}/{g['icon']}.png") if g.get('icon') else EMPTY,
-                "is_music": False, "album_art": None, "id": g['id']
+                "avatar": EMPTY, "avatar_url": f"https://cdn.discordapp.com/icons/{g['id']}/{g['icon']}.png" if g.get('icon') else None,
+                "is_music": False, "album_art": None, "art_url": None, "progress": 0, "id": g['id']
             }
 
         # 2. GITHUB
         elif type_mode == 'github':
             # Repo
             if '/' in key:
-                r = requests.get(f"https://api.github.com/repos/{key}", headers=HEADERS, timeout=4)
-                d = r.json()
-                if 'id' not in d: return None
+                d = fetch_json(f"https://api.github.com/repos/{key}", "github")
+                if 'id' not in d: raise LookupError("unknown repo")
                 score = (d.get('stargazers_count',0) * 2) + d.get('forks_count',0)
                 rank = "SSS" if score > 5000 else "A"
                 title = force_name if force_name else d['name']
                 return {
                     "type": "github", "name": sanitize_xml(title),
                     "l1": f"RANK: {rank}", "l2": f"★ {d.get('stargazers_count')} ⑂ {d.get('forks_count')}",
-                    "color": "#FFF", "avatar": get_base64(d['owner']['avatar_url']),
-                    "album_art": None, "is_music": False, "progress": 0, "id": str(d['id'])
+                    "color": "#FFF", "avatar": EMPTY, "avatar_url": d['owner']['avatar_url'],
+                    "album_art": None, "art_url": None, "is_music": False, "progress": 0, "id": str(d['id'])
                 }
             # User
             else:
-                r = requests.get(f"https://api.github.com/users/{key}", headers=HEADERS, timeout=4)
-                d = r.json()
+                d = fetch_json(f"https://api.github.com/users/{key}", "github")
                 title = force_name if force_name else d.get('login')
                 return {
                     "type": "github", "name": sanitize_xml(title),
                     "l1": "REPOSITORIES", "l2": f"{d.get('public_repos',0)}",
-                    "color": "#FFF", "avatar": get_base64(d.get('avatar_url')),
-                    "album_art": None, "is_music": False, "progress": 0, "id": str(d.get('id',0))
+                    "color": "#FFF", "avatar": EMPTY, "avatar_url": d.get('avatar_url'),
+                    "album_art": None, "art_url": None, "is_music": False, "progress": 0, "id": str(d.get('id',0))
                 }
 
         # 3. LANYARD USER
         else:
-            r = requests.get(f"https://api.lanyard.rest/v1/users/{key}", headers=HEADERS, timeout=4)
-            d = r.json().get('data', {})
-            if not d: return None
+            # Discord snowflake IDs only, and only IDs Lanyard knows get a presence subscription
+            if not (key.isdigit() and 17 <= len(key) <= 20): raise LookupError("not a Discord user ID")
+            d = PRESENCE.get(key)
+            if not d:
+                d = fetch_json(f"https://api.lanyard.rest/v1/users/{key}", "lanyard").get('data', {})
+                if not d: raise LookupError("no presence")
+                PRESENCE.track(key)
             
             u = d['discord_user']
             status = d['discord_status']
@@ -180,7 +1140,7 @@ def fetch_data(key, type_mode, args):
             final_name = sanitize_xml(force_name if force_name else dname)
             
             l1, l2, col = "", "", "#555"
-            is_music, art, progress = False, None, 0.0
+            is_music, art_url, progress = False, None, 0.0
             cols = {"online": "#00FF99", "idle": "#FFBB00", "dnd": "#FF4444", "offline": "#555", "spotify": "#1DB954"}
             
             if d.get('spotify'):
@@ -188,12 +1148,13 @@ def fetch_data(key, type_mode, args):
                 l1 = f"🎵 {s['song']}"
                 l2 = f"By {s['artist']}"
                 col = cols['spotify']
-                art = get_base64(s.get('album_art_url'))
+                art_url = s.get('album_art_url')
                 is_music = True
                 try: 
-                    now = time.time()*1000
+                    # Whole PROGRESS_STEP steps, so the rendered badge (and its ETag) holds still between them
+                    now = time.time() // PROGRESS_STEP * PROGRESS_STEP * 1000
                     p = min(max(((now - s['timestamps']['start']) / (s['timestamps']['end'] - s['timestamps']['start']))*100, 0), 100)
-                    progress = p
+                    progress = round(p, 1)
                 except: pass
             else:
                 col = cols.get(status, "#555")
@@ -212,10 +1173,11 @@ def fetch_data(key, type_mode, args):
                 "l1": sanitize_xml(l1)[:35], 
                 "l2": sanitize_xml(l2)[:40],
                 "color": col, 
-                "avatar": get_base64(f"https://cdn.discordapp.com/avatars/{u['id']}/{u['avatar']}.png"),
-                "album_art": art, "is_music": is_music, "progress": progress, "id": u['id']
+                "avatar": EMPTY, "avatar_url": f"https://cdn.discordapp.com/avatars/{u['id']}/{u['avatar']}.png",
+                "album_art": None, "art_url": art_url, "is_music": is_music, "progress": progress, "id": u['id']
             }
-    except:
+    except Exception as e:
+        METRICS.inc("badge_errors_total", stage="fetch_data", error=type(e).__name__)
         return None
 
 # ===========================
@@ -223,92 +1185,205 @@ def fetch_data(key, type_mode, args):
 #      Standardized Sig: (d, msg, css, radius, bg)
 # ===========================
 
-def render_compact(d, msg, css, radius, bg):
+def _b(v):
+    return v if v.__class__ is bytes else str(v).encode()
+
+class Template:
     """
-    Compact Server Mode.
-    Background is Animated. Foreground is Static (removed classes).
-    Big Number for L1.
+    Badge markup compiled once at import.
+    Static chunks are pre-encoded to bytes and the source becomes one generated
+    b"".join(...) expression, so a render is a single join over chunks + fields.
+    Staying in bytes also keeps one emoji from widening a 50KB inlined image to UCS-4.
+    {d[key]} reads a str from the fetch_data dict, {name} is a keyword argument (str, bytes or number).
+    Values must already be escaped (fetch_data / sanitize_xml) or be trusted markup.
     """
-    # Background Mesh
-    bg_svg = f"""<rect width="100%" height="100%" fill="#{bg}" /><circle r="120" fill="#5865F2" opacity="0.3" class="mesh-1" filter="url(#b)" /><circle r="90" fill="#00CFFF" opacity="0.25" class="mesh-2" filter="url(#b)" />"""
-    
-    return f"""<svg width="400" height="110" viewBox="0 0 400 110" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">
+    def __init__(self, source):
+        params, parts, ns = [], [], {"_b": _b}
+        for literal, field, _, _ in string.Formatter().parse(source):
+            if literal:
+                ns[f"c{len(ns)}"] = literal.encode()
+                parts.append(f"c{len(ns) - 1}")
+            if not field: continue
+            if field.startswith("d["):
+                parts.append(f"d[{field[2:-1]!r}].encode()")
+            else:
+                parts.append(f"_b({field})")
+                if field not in params: params.append(field)
+        # Same trick as namedtuple: generate the function source once, eval it once
+        self.render = eval(f'lambda d{"".join(", " + p for p in params)}: b"".join(({", ".join(parts)},))', ns)
+
+# --- Compact ---
+T_COMPACT = Template("""<svg width="400" height="110" viewBox="0 0 400 110" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">
       <defs><style>{css}.mono{{font-family:'JetBrains Mono'}}.big{{font-family:'Outfit';font-weight:900}}</style>
       <clipPath id="cp"><rect width="400" height="110" rx="{radius}"/></clipPath>
       <clipPath id="av"><rect width="70" height="70" rx="14"/></clipPath>
       <filter id="b"><feGaussianBlur stdDeviation="25"/></filter>
       </defs>
-      <g clip-path="url(#cp)">{bg_svg}<rect width="100%" height="100%" fill="rgba(255,255,255,0.02)" stroke="rgba(255,255,255,0.1)" stroke-width="2" rx="{radius}"/></g>
+      <g clip-path="url(#cp)"><rect width="100%" height="100%" fill="#{bg}" /><circle r="120" fill="#5865F2" opacity="0.3" class="mesh-1" filter="url(#b)" /><circle r="90" fill="#00CFFF" opacity="0.25" class="mesh-2" filter="url(#b)" /><rect width="100%" height="100%" fill="rgba(255,255,255,0.02)" stroke="rgba(255,255,255,0.1)" stroke-width="2" rx="{radius}"/></g>
       <g transform="translate(20, 20)">
          <g>
             <rect width="70" height="70" rx="14" fill="rgba(0,0,0,0.3)"/>
-            <g clip-path="url(#av)"><image href="{d['avatar']}" width="70" height="70"/></g>
-            <rect width="70" height="70" rx="14" fill="none" stroke="{d['color']}" stroke-width="2"/>
+            <g clip-path="url(#av)"><image href="{d[avatar]}" width="70" height="70"/></g>
+            <rect width="70" height="70" rx="14" fill="none" stroke="{d[color]}" stroke-width="2"/>
          </g>
          <!-- Server Name removed, used as small Label -->
          <g transform="translate(90, 8)">
-            <text x="0" y="10" font-family="Rajdhani" font-weight="700" font-size="11" fill="#888" letter-spacing="3" style="text-transform:uppercase">{d['name']}</text>
-            <text x="0" y="48" class="big" font-size="42" fill="white" letter-spacing="-1">{d['l1']}</text>
+            <text x="0" y="10" font-family="Rajdhani" font-weight="700" font-size="11" fill="#888" letter-spacing="3" style="text-transform:uppercase">{d[name]}</text>
+            <text x="0" y="48" class="big" font-size="42" fill="white" letter-spacing="-1">{d[l1]}</text>
          </g>
       </g>
-    </svg>"""
+    </svg>""")
+
+def render_compact(d, msg, css, radius, bg):
+    """
+    Compact Server Mode.
+    Background is Animated. Foreground is Static (removed classes).
+    Big Number for L1.
+    """
+    return T_COMPACT.render(d, css=css, radius=radius, bg=bg)
+
+# --- Standard (Hyper) ---
+T_STANDARD_AI = Template("""<g transform="translate(145,115)" class="float"><rect width="310" height="30" rx="6" fill="rgba(0,0,0,0.5)" stroke="rgba(255,255,255,0.1)"/><text x="15" y="19" font-family="Rajdhani" font-size="12" fill="#E0E0FF"><tspan fill="{d[color]}">AI //</tspan> {msg}<tspan class="cursor">_</tspan></text></g>""")
+T_STANDARD_ART = Template("""<image href="{d[album_art]}" width="100%" height="100%" preserveAspectRatio="xMidYMid slice" opacity="0.4" filter="url(#bl)"/>""")
+T_STANDARD_DRIFT = Template("""<g class="drift" opacity="0.4"><circle cx="20" cy="20" r="160" fill="{d[color]}" filter="url(#liq)"/><circle cx="450" cy="160" r="140" fill="#5865F2" filter="url(#liq)"/></g>""")
+T_STANDARD = Template("""<svg width="480" height="150" viewBox="0 0 480 150" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs><style>{css}.ui {{font-family:'Rajdhani',sans-serif;}}</style><filter id="liq"><feTurbulence type="fractalNoise" baseFrequency="0.015"/><feDisplacementMap in="SourceGraphic" scale="30"/></filter><filter id="bl"><feGaussianBlur stdDeviation="15"/></filter><clipPath id="cc"><rect width="480" height="150" rx="{radius}"/></clipPath><clipPath id="hc"><path d="M50 0 L93.3 25 V75 L50 100 L6.7 75 V25 Z"/></clipPath></defs><rect width="100%" height="100%" rx="{radius}" fill="#{bg}"/><g clip-path="url(#cc)">{bg_l}<rect width="100%" height="100%" fill="black" opacity="0.2"/></g><g transform="translate(25, 25)"><path d="M50 0 L93.3 25 V75 L50 100 L6.7 75 V25 Z" fill="{d[color]}" opacity="0.2" transform="translate(0,3)"/><g clip-path="url(#hc)"><image href="{d[avatar]}" width="100" height="100"/></g><path d="M50 0 L93.3 25 V75 L50 100 L6.7 75 V25 Z" fill="none" stroke="{d[color]}" stroke-width="3"/></g><g transform="translate(145, 45)" class="float"><text x="0" y="0" class="ui" font-size="28" font-weight="700" fill="white">{d[name]}</text><text x="0" y="25" font-family="JetBrains Mono" font-size="11" fill="{d[color]}">>> {d[l1]}</text><text x="0" y="42" font-family="JetBrains Mono" font-size="10" fill="#DDD">{d[l2]}</text></g>{ai_div}</svg>""")
 
 def render_standard(d, msg, css, radius, bg):
-    img = d['album_art'] if d['album_art'] else d['avatar']
-    hex_path = "M50 0 L93.3 25 V75 L50 100 L6.7 75 V25 Z"
-    ai_div = f'<g transform="translate(145,115)" class="float"><rect width="310" height="30" rx="6" fill="rgba(0,0,0,0.5)" stroke="rgba(255,255,255,0.1)"/><text x="15" y="19" font-family="Rajdhani" font-size="12" fill="#E0E0FF"><tspan fill="{d["color"]}">AI //</tspan> {msg}<tspan class="cursor">_</tspan></text></g>' if msg else ""
-    bg_l = f'<image href="{img}" width="100%" height="100%" preserveAspectRatio="xMidYMid slice" opacity="0.4" filter="url(#bl)"/>' if d['album_art'] else f'<g class="drift" opacity="0.4"><circle cx="20" cy="20" r="160" fill="{d["color"]}" filter="url(#liq)"/><circle cx="450" cy="160" r="140" fill="#5865F2" filter="url(#liq)"/></g>'
-    return f"""<svg width="480" height="150" viewBox="0 0 480 150" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs><style>{css}.ui {{font-family:'Rajdhani',sans-serif;}}</style><filter id="liq"><feTurbulence type="fractalNoise" baseFrequency="0.015"/><feDisplacementMap in="SourceGraphic" scale="30"/></filter><filter id="bl"><feGaussianBlur stdDeviation="15"/></filter><clipPath id="cc"><rect width="480" height="150" rx="{radius}"/></clipPath><clipPath id="hc"><path d="{hex_path}"/></clipPath></defs><rect width="100%" height="100%" rx="{radius}" fill="#{bg}"/><g clip-path="url(#cc)">{bg_l}<rect width="100%" height="100%" fill="black" opacity="0.2"/></g><g transform="translate(25, 25)"><path d="{hex_path}" fill="{d['color']}" opacity="0.2" transform="translate(0,3)"/><g clip-path="url(#hc)"><image href="{d['avatar']}" width="100" height="100"/></g><path d="{hex_path}" fill="none" stroke="{d['color']}" stroke-width="3"/></g><g transform="translate(145, 45)" class="float"><text x="0" y="0" class="ui" font-size="28" font-weight="700" fill="white">{d['name']}</text><text x="0" y="25" font-family="JetBrains Mono" font-size="11" fill="{d['color']}">>> {d['l1']}</text><text x="0" y="42" font-family="JetBrains Mono" font-size="10" fill="#DDD">{d['l2']}</text></g>{ai_div}</svg>"""
+    ai_div = T_STANDARD_AI.render(d, msg=msg) if msg else b""
+    bg_l = T_STANDARD_ART.render(d) if d['album_art'] else T_STANDARD_DRIFT.render(d)
+    return T_STANDARD.render(d, css=css, radius=radius, bg=bg, bg_l=bg_l, ai_div=ai_div)
+
+# --- Chillax ---
+T_CHILLAX_ART = Template("""<image href="{d[album_art]}" width="100%" height="100%" preserveAspectRatio="xMidYMid slice" opacity="0.6" filter="url(#heavyBlur)"/><rect width="100%" height="100%" fill="black" opacity="0.5"/>""")
+T_CHILLAX_MESH = Template("""<rect width="100%" height="100%" fill="#{bg}"/><circle cx="50" cy="50" r="100" fill="#00CFFF" class="mesh-1" opacity="0.4" filter="url(#blur)"/><circle cx="430" cy="130" r="120" fill="#FF00FF" class="mesh-2" opacity="0.4" filter="url(#blur)"/>""")
+T_CHILLAX_AI = Template("""<g transform="translate(130, 95)" class="hover-panel"><rect width="320" height="30" rx="8" fill="rgba(0,0,0,0.6)" stroke="rgba(255,255,255,0.2)"/><text x="15" y="19" font-family="JetBrains Mono" font-size="10" fill="{d[color]}">{msg}<tspan class="cursor">_</tspan></text></g>""")
+T_CHILLAX = Template("""<svg width="480" height="150" viewBox="0 0 480 150" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs><style>{css}.script-font{{font-family:'Pacifico'}}.ui-font{{font-family:'Fredoka'}}</style><clipPath id="c"><rect width="480" height="150" rx="{radius}"/></clipPath><clipPath id="av"><circle cx="50" cy="50" r="45"/></clipPath><filter id="blur"><feGaussianBlur stdDeviation="35"/></filter><filter id="heavyBlur"><feGaussianBlur stdDeviation="10"/></filter><filter id="sh"><feDropShadow dx="0" dy="2" flood-color="black" flood-opacity="0.8"/></filter></defs><g clip-path="url(#c)">{bg_art}<rect width="100%" height="100%" fill="rgba(255,255,255,0.02)"/></g><g transform="translate(30, 25)"><circle cx="50" cy="50" r="48" fill="none" stroke="{d[color]}" stroke-width="3" stroke-dasharray="10 8" opacity="0.8" class="disc-spin"/><g clip-path="url(#av)"><image href="{d[avatar]}" width="100" height="100"/></g><circle cx="85" cy="85" r="9" fill="{d[color]}" stroke="#{bg}" stroke-width="3"/></g><g transform="translate(145, 30)"><text x="0" y="15" class="script-font" font-size="34" fill="white" filter="url(#sh)">{d[name]}</text><g transform="translate(-5, 30)"><rect width="320" height="28" rx="6" fill="rgba(255,255,255,0.1)"/><text x="10" y="19" class="ui-font" font-weight="700" font-size="13" fill="white"><tspan fill="{d[color]}">></tspan> {d[l1]} {d[l2]}</text></g></g>{ai_e}<text x="470" y="145" text-anchor="end" class="ui-font" font-size="9" fill="#777">ID: {d[id]}</text></svg>""")
 
 def render_chillax(d, msg, css, radius, bg_arg):
     bg = bg_arg if bg_arg else "18191c"
-    bg_art = f'<image href="{d["album_art"]}" width="100%" height="100%" preserveAspectRatio="xMidYMid slice" opacity="0.6" filter="url(#heavyBlur)"/><rect width="100%" height="100%" fill="black" opacity="0.5"/>' if d['album_art'] else f"""<rect width="100%" height="100%" fill="#{bg}"/><circle cx="50" cy="50" r="100" fill="#00CFFF" class="mesh-1" opacity="0.4" filter="url(#blur)"/><circle cx="430" cy="130" r="120" fill="#FF00FF" class="mesh-2" opacity="0.4" filter="url(#blur)"/>"""
-    ai_e = f"""<g transform="translate(130, 95)" class="hover-panel"><rect width="320" height="30" rx="8" fill="rgba(0,0,0,0.6)" stroke="rgba(255,255,255,0.2)"/><text x="15" y="19" font-family="JetBrains Mono" font-size="10" fill="{d['color']}">{msg}<tspan class="cursor">_</tspan></text></g>""" if msg else ""
-    return f"""<svg width="480" height="150" viewBox="0 0 480 150" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs><style>{css}.script-font{{font-family:'Pacifico'}}.ui-font{{font-family:'Fredoka'}}</style><clipPath id="c"><rect width="480" height="150" rx="{radius}"/></clipPath><clipPath id="av"><circle cx="50" cy="50" r="45"/></clipPath><filter id="blur"><feGaussianBlur stdDeviation="35"/></filter><filter id="heavyBlur"><feGaussianBlur stdDeviation="10"/></filter><filter id="sh"><feDropShadow dx="0" dy="2" flood-color="black" flood-opacity="0.8"/></filter></defs><g clip-path="url(#c)">{bg_art}<rect width="100%" height="100%" fill="rgba(255,255,255,0.02)"/></g><g transform="translate(30, 25)"><circle cx="50" cy="50" r="48" fill="none" stroke="{d['color']}" stroke-width="3" stroke-dasharray="10 8" opacity="0.8" class="disc-spin"/><g clip-path="url(#av)"><image href="{d['avatar']}" width="100" height="100"/></g><circle cx="85" cy="85" r="9" fill="{d['color']}" stroke="#{bg}" stroke-width="3"/></g><g transform="translate(145, 30)"><text x="0" y="15" class="script-font" font-size="34" fill="white" filter="url(#sh)">{d['name']}</text><g transform="translate(-5, 30)"><rect width="320" height="28" rx="6" fill="rgba(255,255,255,0.1)"/><text x="10" y="19" class="ui-font" font-weight="700" font-size="13" fill="white"><tspan fill="{d['color']}">></tspan> {d['l1']} {d['l2']}</text></g></g>{ai_e}<text x="470" y="145" text-anchor="end" class="ui-font" font-size="9" fill="#777">ID: {d['id']}</text></svg>"""
+    bg_art = T_CHILLAX_ART.render(d) if d['album_art'] else T_CHILLAX_MESH.render(d, bg=bg)
+    ai_e = T_CHILLAX_AI.render(d, msg=msg) if msg else b""
+    return T_CHILLAX.render(d, css=css, radius=radius, bg=bg, bg_art=bg_art, ai_e=ai_e)
+
+# --- Spotify ---
+T_SPOTIFY_AI = Template("""<text x="120" y="70" class="m" font-size="10" fill="#E0E0FF" opacity="0.7">AI // {msg}</text>""")
+SPOTIFY_DISC = b'<circle cx="50" cy="50" r="20" fill="none" stroke="white" stroke-dasharray="10 5" opacity="0.5" class="disc-spin"/>'
+T_SPOTIFY = Template("""<svg width="480" height="150" viewBox="0 0 480 150" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs><style>{css}.u{{font-family:'Rajdhani'}}.m{{font-family:'JetBrains Mono'}}</style><clipPath id="cp"><rect width="480" height="150" rx="{radius}"/></clipPath><clipPath id="ac"><rect width="100" height="100" rx="8"/></clipPath><filter id="bl"><feGaussianBlur stdDeviation="15"/></filter></defs><rect width="100%" height="100%" rx="{radius}" fill="#{bg}"/><g clip-path="url(#cp)"><image href="{img}" width="480" height="480" x="0" y="-165" opacity="0.3" filter="url(#bl)"/><rect width="100%" height="100%" fill="black" opacity="0.2"/></g><g transform="translate(20, 20)"><g class="float"><g clip-path="url(#ac)"><image href="{img}" width="100" height="100"/></g><rect width="100" height="100" rx="10" fill="none" stroke="rgba(255,255,255,0.1)"/>{disc}</g><g transform="translate(115, 10)"><text class="u" font-size="10" font-weight="bold" fill="#bbb" letter-spacing="2">NOW PLAYING</text><text y="28" class="u" font-size="24" font-weight="bold" fill="white">{d[l1]}</text><text y="50" class="m" font-size="12" fill="{d[color]}">{d[l2]}</text><text y="70" class="m" font-size="10" fill="#999">User: {d[name]}</text>{ai_html}</g></g><g transform="translate(20, 135)"><rect width="440" height="4" rx="2" fill="rgba(255,255,255,0.15)"/><rect width="{pw}" height="4" rx="2" fill="{d[color]}"/></g></svg>""")
 
 def render_spotify(d, msg, css, radius, bg):
     img = d['album_art'] if d['album_art'] else d['avatar']
-    ai_html = f'<text x="120" y="70" class="m" font-size="10" fill="#E0E0FF" opacity="0.7">AI // {msg}</text>' if msg else ""
+    ai_html = T_SPOTIFY_AI.render(d, msg=msg) if msg else b""
     pw = (d['progress'] / 100.0) * 440
-    return f"""<svg width="480" height="150" viewBox="0 0 480 150" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs><style>{css}.u{{font-family:'Rajdhani'}}.m{{font-family:'JetBrains Mono'}}</style><clipPath id="cp"><rect width="480" height="150" rx="{radius}"/></clipPath><clipPath id="ac"><rect width="100" height="100" rx="8"/></clipPath><filter id="bl"><feGaussianBlur stdDeviation="15"/></filter></defs><rect width="100%" height="100%" rx="{radius}" fill="#{bg}"/><g clip-path="url(#cp)"><image href="{img}" width="480" height="480" x="0" y="-165" opacity="0.3" filter="url(#bl)"/><rect width="100%" height="100%" fill="black" opacity="0.2"/></g><g transform="translate(20, 20)"><g class="float"><g clip-path="url(#ac)"><image href="{img}" width="100" height="100"/></g><rect width="100" height="100" rx="10" fill="none" stroke="rgba(255,255,255,0.1)"/>{'<circle cx="50" cy="50" r="20" fill="none" stroke="white" stroke-dasharray="10 5" opacity="0.5" class="disc-spin"/>' if d['is_music'] else ''}</g><g transform="translate(115, 10)"><text class="u" font-size="10" font-weight="bold" fill="#bbb" letter-spacing="2">NOW PLAYING</text><text y="28" class="u" font-size="24" font-weight="bold" fill="white">{d['l1']}</text><text y="50" class="m" font-size="12" fill="{d['color']}">{d['l2']}</text><text y="70" class="m" font-size="10" fill="#999">User: {d['name']}</text>{ai_html}</g></g><g transform="translate(20, 135)"><rect width="440" height="4" rx="2" fill="rgba(255,255,255,0.15)"/><rect width="{pw}" height="4" rx="2" fill="{d['color']}"/></g></svg>"""
+    disc = SPOTIFY_DISC if d['is_music'] else b""
+    return T_SPOTIFY.render(d, css=css, radius=radius, bg=bg, img=img, disc=disc, ai_html=ai_html, pw=pw)
+
+# --- Easter Egg ---
+T_EASTEREGG_ART = Template("""<image href="{d[album_art]}" width="100%" height="100%" preserveAspectRatio="xMidYMid slice" opacity="0.6" filter="url(#heavyBlur)"/><rect width="100%" height="100%" fill="black" opacity="0.6"/>""")
+T_EASTEREGG_MESH = Template("""<rect width="100%" height="100%" fill="#050505"/><circle r="120" fill="{d[color]}" class="mesh-1" opacity="0.6" filter="url(#fb)"/><circle r="150" fill="#5865F2" class="mesh-2" opacity="0.5" filter="url(#fb)"/><circle r="100" fill="#00FFFF" class="mesh-3" opacity="0.4" filter="url(#fb)"/>""")
+T_EASTEREGG_AI = Template("""<g transform="translate(130, 20)" class="hover-panel-2"><rect width="220" height="24" rx="12" fill="black" stroke="rgba(255,255,255,0.15)"/><text x="110" y="16" text-anchor="middle" font-family="JetBrains Mono" font-size="9" fill="#EEE"><tspan fill="{d[color]}">●</tspan> {msg}</text></g>""")
+T_EASTEREGG = Template("""<svg width="480" height="180" viewBox="0 0 480 180" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs><style>{css}</style><filter id="heavyBlur"><feGaussianBlur stdDeviation="15"/></filter><filter id="fb"><feGaussianBlur stdDeviation="30"/><feComposite in="SourceGraphic" operator="over"/></filter><clipPath id="main"><rect width="480" height="180" rx="{radius}"/></clipPath><clipPath id="sq"><path d="M 20,0 H 80 C 100,0 100,20 100,20 V 80 C 100,100 80,100 80,100 H 20 C 0,100 0,80 0,80 V 20 C 0,0 20,0 20,0 Z" /></clipPath><linearGradient id="rb"><stop offset="0%" stop-color="{d[color]}"/><stop offset="50%" stop-color="#00FFFF"/><stop offset="100%" stop-color="{d[color]}"/></linearGradient></defs><g clip-path="url(#main)">{bg_el}<pattern id="gn" width="100" height="100" patternUnits="userSpaceOnUse"><rect width="1" height="1" fill="white" opacity="0.05"/></pattern><rect width="100%" height="100%" fill="url(#gn)"/></g><rect x="2" y="2" width="476" height="176" rx="{radius}" fill="none" stroke="url(#rb)" stroke-width="4" class="flow-border" opacity="0.8"/><g transform="translate(20, 20)"><circle cx="0" cy="0" r="5" fill="#FF5F56"/><circle cx="15" cy="0" r="5" fill="#FFBD2E"/><circle cx="30" cy="0" r="5" fill="#27C93F"/></g>{ai_html}<g transform="translate(25, 50)" class="hover-panel"><rect x="5" y="5" width="100" height="100" rx="20" fill="black" opacity="0.3"/><g clip-path="url(#sq)"><image href="{d[avatar]}" width="100" height="100"/><path d="M 0,0 L 100,0 L 0,100 Z" fill="white" opacity="0.1"/></g><path d="M 20,0 H 80 C 100,0 100,20 100,20 V 80 C 100,100 80,100 80,100 H 20 C 0,100 0,80 0,80 V 20 C 0,0 20,0 20,0 Z" fill="none" stroke="rgba(255,255,255,0.4)" stroke-width="2"/></g><g transform="translate(145, 60)" class="float"><text x="0" y="0" font-family="Outfit" font-weight="900" font-size="34" fill="white">{d[name]}</text><g transform="translate(0, 15)"><text x="0" y="20" font-family="JetBrains Mono" font-weight="800" font-size="13" fill="{d[color]}">>> {l1_upper}</text><text x="0" y="40" font-family="Outfit" font-weight="700" font-size="14" fill="#EEE">{d[l2]}</text></g></g></svg>""")
 
 def render_easteregg(d, msg, css, radius, bg=None):
     # Added bg arg to match signature (even if unused)
-    bg_el = f'<image href="{d["album_art"]}" width="100%" height="100%" preserveAspectRatio="xMidYMid slice" opacity="0.6" filter="url(#heavyBlur)"/><rect width="100%" height="100%" fill="black" opacity="0.6"/>' if d['album_art'] else f"""<rect width="100%" height="100%" fill="#050505"/><circle r="120" fill="{d['color']}" class="mesh-1" opacity="0.6" filter="url(#fb)"/><circle r="150" fill="#5865F2" class="mesh-2" opacity="0.5" filter="url(#fb)"/><circle r="100" fill="#00FFFF" class="mesh-3" opacity="0.4" filter="url(#fb)"/>"""
-    ai_html = f"""<g transform="translate(130, 20)" class="hover-panel-2"><rect width="220" height="24" rx="12" fill="black" stroke="rgba(255,255,255,0.15)"/><text x="110" y="16" text-anchor="middle" font-family="JetBrains Mono" font-size="9" fill="#EEE"><tspan fill="{d['color']}">●</tspan> {msg}</text></g>""" if msg else ""
-    return f"""<svg width="480" height="180" viewBox="0 0 480 180" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs><style>{css}</style><filter id="heavyBlur"><feGaussianBlur stdDeviation="15"/></filter><filter id="fb"><feGaussianBlur stdDeviation="30"/><feComposite in="SourceGraphic" operator="over"/></filter><clipPath id="main"><rect width="480" height="180" rx="{radius}"/></clipPath><clipPath id="sq"><path d="M 20,0 H 80 C 100,0 100,20 100,20 V 80 C 100,100 80,100 80,100 H 20 C 0,100 0,80 0,80 V 20 C 0,0 20,0 20,0 Z" /></clipPath><linearGradient id="rb"><stop offset="0%" stop-color="{d['color']}"/><stop offset="50%" stop-color="#00FFFF"/><stop offset="100%" stop-color="{d['color']}"/></linearGradient></defs><g clip-path="url(#main)">{bg_el}<pattern id="gn" width="100" height="100" patternUnits="userSpaceOnUse"><rect width="1" height="1" fill="white" opacity="0.05"/></pattern><rect width="100%" height="100%" fill="url(#gn)"/></g><rect x="2" y="2" width="476" height="176" rx="{radius}" fill="none" stroke="url(#rb)" stroke-width="4" class="flow-border" opacity="0.8"/><g transform="translate(20, 20)"><circle cx="0" cy="0" r="5" fill="#FF5F56"/><circle cx="15" cy="0" r="5" fill="#FFBD2E"/><circle cx="30" cy="0" r="5" fill="#27C93F"/></g>{ai_html}<g transform="translate(25, 50)" class="hover-panel"><rect x="5" y="5" width="100" height="100" rx="20" fill="black" opacity="0.3"/><g clip-path="url(#sq)"><image href="{d['avatar']}" width="100" height="100"/><path d="M 0,0 L 100,0 L 0,100 Z" fill="white" opacity="0.1"/></g><path d="M 20,0 H 80 C 100,0 100,20 100,20 V 80 C 100,100 80,100 80,100 H 20 C 0,100 0,80 0,80 V 20 C 0,0 20,0 20,0 Z" fill="none" stroke="rgba(255,255,255,0.4)" stroke-width="2"/></g><g transform="translate(145, 60)" class="float"><text x="0" y="0" font-family="Outfit" font-weight="900" font-size="34" fill="white">{d['name']}</text><g transform="translate(0, 15)"><text x="0" y="20" font-family="JetBrains Mono" font-weight="800" font-size="13" fill="{d['color']}">>> {d['l1'].upper()}</text><text x="0" y="40" font-family="Outfit" font-weight="700" font-size="14" fill="#EEE">{d['l2']}</text></g></g></svg>"""
+    bg_el = T_EASTEREGG_ART.render(d) if d['album_art'] else T_EASTEREGG_MESH.render(d)
+    ai_html = T_EASTEREGG_AI.render(d, msg=msg) if msg else b""
+    return T_EASTEREGG.render(d, css=css, radius=radius, bg_el=bg_el, ai_html=ai_html, l1_upper=d['l1'].upper())
+
+# --- Cute ---
+T_CUTE_AI = Template("""<g transform="translate(0,60)" class="bob"><rect width="280" height="30" rx="15" fill="white" opacity="0.8" stroke="{d[color]}" stroke-width="1"/><text x="15" y="19" font-family="Fredoka" font-size="11" fill="#888">🐰 {msg}</text></g>""")
+T_CUTE = Template("""<svg width="480" height="180" viewBox="0 0 480 180" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs><style>{css}</style><pattern id="heart" width="40" height="40" patternUnits="userSpaceOnUse"><text x="0" y="20" font-size="10" opacity="0.1" fill="{d[color]}">❤</text><text x="20" y="40" font-size="10" opacity="0.1" fill="{d[color]}">❤</text></pattern><clipPath id="cr"><circle cx="65" cy="65" r="55"/></clipPath></defs><rect width="480" height="180" rx="30" fill="#FFFAFA"/><rect width="100%" height="100%" fill="url(#heart)" class="scroll-bg"/><rect x="5" y="5" width="470" height="170" rx="25" fill="none" stroke="{d[color]}" stroke-width="4" stroke-dasharray="15 10" opacity="0.4"/><g transform="translate(25,25)"><circle cx="65" cy="65" r="60" fill="{d[color]}"/><circle cx="65" cy="65" r="55" fill="white"/><image href="{d[avatar]}" width="130" height="130" clip-path="url(#cr)"/></g><g transform="translate(170,55)"><text y="0" font-family="Fredoka" font-weight="600" font-size="30" fill="#555">{d[name]}</text><rect y="10" width="220" height="25" rx="12" fill="#F0F0F0"/><text x="10" y="26" font-family="Fredoka" font-size="12" fill="{d[color]}">✨ {d[l1]} {d[l2]}</text>{ai_svg}</g></svg>""")
 
 def render_cute(d, msg, css, radius, bg):
     # Added unused args for compatibility
-    c = d['color']
-    ai_svg = f"""<g transform="translate(0,60)" class="bob"><rect width="280" height="30" rx="15" fill="white" opacity="0.8" stroke="{c}" stroke-width="1"/><text x="15" y="19" font-family="Fredoka" font-size="11" fill="#888">🐰 {msg.capitalize()}</text></g>""" if msg else ""
-    return f"""<svg width="480" height="180" viewBox="0 0 480 180" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs><style>{css}</style><pattern id="heart" width="40" height="40" patternUnits="userSpaceOnUse"><text x="0" y="20" font-size="10" opacity="0.1" fill="{c}">❤</text><text x="20" y="40" font-size="10" opacity="0.1" fill="{c}">❤</text></pattern><clipPath id="cr"><circle cx="65" cy="65" r="55"/></clipPath></defs><rect width="480" height="180" rx="30" fill="#FFFAFA"/><rect width="100%" height="100%" fill="url(#heart)" class="scroll-bg"/><rect x="5" y="5" width="470" height="170" rx="25" fill="none" stroke="{c}" stroke-width="4" stroke-dasharray="15 10" opacity="0.4"/><g transform="translate(25,25)"><circle cx="65" cy="65" r="60" fill="{c}"/><circle cx="65" cy="65" r="55" fill="white"/><image href="{d['avatar']}" width="130" height="130" clip-path="url(#cr)"/></g><g transform="translate(170,55)"><text y="0" font-family="Fredoka" font-weight="600" font-size="30" fill="#555">{d['name']}</text><rect y="10" width="220" height="25" rx="12" fill="#F0F0F0"/><text x="10" y="26" font-family="Fredoka" font-size="12" fill="{c}">✨ {d['l1']} {d['l2']}</text>{ai_svg}</g></svg>"""
+    ai_svg = T_CUTE_AI.render(d, msg=msg.capitalize()) if msg else b""
+    return T_CUTE.render(d, css=css, ai_svg=ai_svg)
+
+# --- Terminal ---
+T_TERMINAL_AI = Template("""<text x="15" y="100" fill="#569CD6">ai.query</text><text x="70" y="100" fill="#CE9178">("{d[name]}")</text><text x="15" y="120" fill="#6A9955">// {msg}<tspan class="cursor">_</tspan></text>""")
+T_TERMINAL = Template("""<svg width="480" height="180" viewBox="0 0 480 180" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs><style>{css}</style><pattern id="sl" width="4" height="4" patternUnits="userSpaceOnUse"><rect width="4" height="1" fill="black" opacity="0.3"/></pattern></defs><rect width="100%" height="100%" rx="6" fill="#1e1e1e"/><rect width="100%" height="100%" fill="url(#sl)" pointer-events="none"/><rect width="100%" height="25" fill="#252526"/><circle cx="20" cy="12" r="5" fill="#ff5f56"/><circle cx="40" cy="12" r="5" fill="#ffbd2e"/><circle cx="60" cy="12" r="5" fill="#27c93f"/><g transform="translate(15, 45)" font-family="Fira Code" font-size="12"><text y="0" fill="#C586C0">const</text> <text x="40" y="0" fill="#4FC1FF">usr</text> <text x="65" y="0" fill="#D4D4D4">=</text> <text x="80" y="0" fill="#CE9178">"{d[name]}"</text><text y="20" fill="#9CDCFE">usr.status</text> <text x="75" y="20" fill="#D4D4D4">=</text> <text x="90" y="20" fill="#B5CEA8">"{d[l1]} {d[l2]}"</text>{ai_svg}</g><rect y="160" width="100%" height="20" fill="#5865F2"/><text x="10" y="173" font-family="Fira Code" font-size="10" fill="white">NORMAL</text><image href="{d[avatar]}" x="380" y="40" width="80" height="80" opacity="0.9" rx="4"/></svg>""")
 
 def render_terminal(d, msg, css, radius, bg):
     # Added unused args for compatibility
-    ai_svg = f"""<text x="15" y="100" fill="#569CD6">ai.query</text><text x="70" y="100" fill="#CE9178">("{d['name']}")</text><text x="15" y="120" fill="#6A9955">// {msg}<tspan class="cursor">_</tspan></text>""" if msg else ""
-    return f"""<svg width="480" height="180" viewBox="0 0 480 180" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs><style>{css}</style><pattern id="sl" width="4" height="4" patternUnits="userSpaceOnUse"><rect width="4" height="1" fill="black" opacity="0.3"/></pattern></defs><rect width="100%" height="100%" rx="6" fill="#1e1e1e"/><rect width="100%" height="100%" fill="url(#sl)" pointer-events="none"/><rect width="100%" height="25" fill="#252526"/><circle cx="20" cy="12" r="5" fill="#ff5f56"/><circle cx="40" cy="12" r="5" fill="#ffbd2e"/><circle cx="60" cy="12" r="5" fill="#27c93f"/><g transform="translate(15, 45)" font-family="Fira Code" font-size="12"><text y="0" fill="#C586C0">const</text> <text x="40" y="0" fill="#4FC1FF">usr</text> <text x="65" y="0" fill="#D4D4D4">=</text> <text x="80" y="0" fill="#CE9178">"{d['name']}"</text><text y="20" fill="#9CDCFE">usr.status</text> <text x="75" y="20" fill="#D4D4D4">=</text> <text x="90" y="20" fill="#B5CEA8">"{d['l1']} {d['l2']}"</text>{ai_svg}</g><rect y="160" width="100%" height="20" fill="#5865F2"/><text x="10" y="173" font-family="Fira Code" font-size="10" fill="white">NORMAL</text><image href="{d['avatar']}" x="380" y="40" width="80" height="80" opacity="0.9" rx="4"/></svg>"""
+    ai_svg = T_TERMINAL_AI.render(d, msg=msg) if msg else b""
+    return T_TERMINAL.render(d, css=css, ai_svg=ai_svg)
+
+# --- Professional ---
+T_PRO_NOTE = Template("""<text y="90" font-size="10" fill="#999" font-style="italic">NOTE: {msg}</text>""")
+T_PRO = Template("""<svg width="480" height="140" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs><clipPath id="s"><rect width="90" height="90" rx="4"/></clipPath></defs><rect width="478" height="138" x="1" y="1" rx="4" fill="#FFFFFF" stroke="#e1e4e8"/><rect width="6" height="138" x="1" y="1" rx="1" fill="{d[color]}"/><g transform="translate(30,25)"><image href="{d[avatar]}" width="90" height="90" clip-path="url(#s)"/><rect width="90" height="90" rx="4" fill="none" stroke="rgba(0,0,0,0.1)"/></g><g transform="translate(140,35)" font-family="Arial"><text y="0" font-weight="bold" font-size="22" fill="#333">{d[name]}</text><text y="30" font-size="11" font-weight="bold" fill="#586069">{d[l1]}</text><text y="45" font-size="11" fill="#586069">{d[l2]}</text><line x1="0" y1="70" x2="300" y2="70" stroke="#eee"/>{msg_html}</g></svg>""")
 
 def render_pro(d, msg, css, radius, bg):
     # Added unused args for compatibility
-    msg_html = f'<text y="90" font-size="10" fill="#999" font-style="italic">NOTE: {msg}</text>' if msg else ""
-    return f"""<svg width="480" height="140" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs><clipPath id="s"><rect width="90" height="90" rx="4"/></clipPath></defs><rect width="478" height="138" x="1" y="1" rx="4" fill="#FFFFFF" stroke="#e1e4e8"/><rect width="6" height="138" x="1" y="1" rx="1" fill="{d['color']}"/><g transform="translate(30,25)"><image href="{d['avatar']}" width="90" height="90" clip-path="url(#s)"/><rect width="90" height="90" rx="4" fill="none" stroke="rgba(0,0,0,0.1)"/></g><g transform="translate(140,35)" font-family="Arial"><text y="0" font-weight="bold" font-size="22" fill="#333">{d['name']}</text><text y="30" font-size="11" font-weight="bold" fill="#586069">{d['l1']}</text><text y="45" font-size="11" fill="#586069">{d['l2']}</text><line x1="0" y1="70" x2="300" y2="70" stroke="#eee"/>{msg_html}</g></svg>"""
+    msg_html = T_PRO_NOTE.render(d, msg=msg) if msg else b""
+    return T_PRO.render(d, msg_html=msg_html)
 
+# Drawn size (px) of the avatar / album art per style, images are embedded at IMAGE_SCALE x this
+STYLE_IMAGE_BOX = {
+    "compact": 70,
+    "standard": 100,
+    "chillax": 100,
+    "spotify": 100,
+    "easteregg": 100,
+    "cute": 130,
+    "terminal": 80,
+    "pro": 90,
+    "professional": 90,
+}
+
+# Style registry: ?style=NAME -> renderer, anything unknown falls back to render_standard
+STYLES = {
+    "compact": render_compact,
+    "chillax": render_chillax,
+    "spotify": render_spotify,
+    "easteregg": render_easteregg,
+    "cute": render_cute,
+    "terminal": render_terminal,
+    "pro": render_pro,
+    "professional": render_pro,
+}
+
+# ===========================
+#        OUTPUT CACHE
+# ===========================
+
+def output_key(mode, style, args, data):
+    """Fingerprint of everything a rendered badge depends on (query args + upstream data)."""
+    fields = {k: v for k, v in data.items() if k not in ('avatar', 'album_art')}
+    raw = json.dumps([mode, style, sorted(args.items(multi=True)), fields], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def svg_response(badge_type, svg, etag, img_saved=0, complete=True):
+    max_age, swr = CACHE_POLICY.get(badge_type, (0, 0))
+    headers = {
+        # Degraded renders must be refetched, so the full badge replaces them as soon as it is ready
+        "Cache-Control": f"public, max-age={max_age}, stale-while-revalidate={swr}" if complete else "no-cache",
+        "X-Image-Reencode-Bytes-Saved": str(img_saved),
+    }
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304, headers=headers)
+    else:
+        resp = Response(svg, mimetype="image/svg+xml", headers=headers)
+    resp.set_etag(etag)
+    return resp
 
 # ===========================
 #        MAIN CONTROLLER
 # ===========================
 
-@app.route('/superbadge/<key>')
-@app.route('/badge/<mode>/<key>')
-def handler(key, mode="auto"):
-    args = request.args
+ERROR_SVG = '<svg xmlns="http://www.w3.org/2000/svg" width="300" height="50"><rect width="100%" height="100%" fill="black"/><text x="10" y="30" fill="red" font-family="sans-serif">DATA API ERROR</text></svg>'
+
+def build_badge(key, mode, args, started, timings=None):
+    """
+    Renders one badge: (badge_type, svg, etag, img_saved, complete), or None when upstream has no data.
+    Shared by the single badge routes and /badges. Stage durations (seconds) are
+    added to timings when given.
+    """
     target_mode = mode
     if mode == "auto":
         target_mode = 'user' if (key.isdigit() and len(str(key)) > 15) else 'discord'
     
-    data = fetch_data(key, target_mode, args)
-    if not data: return Response('<svg xmlns="http://www.w3.org/2000/svg" width="300" height="50"><rect width="100%" height="100%" fill="black"/><text x="10" y="30" fill="red" font-family="sans-serif">DATA API ERROR</text></svg>', mimetype="image/svg+xml")
+    with METRICS.timer("badge_stage_seconds", timings, stage="upstream"):
+        data = fetch_data(key, target_mode, args)
+    if not data: return None
 
     # Settings
     ai_on = args.get('aifeatures', 'true')
@@ -318,8 +1393,8 @@ def handler(key, mode="auto"):
     fg_an = args.get('fgAnimations', 'true')
     style = args.get('style', 'hyper').lower()
     
-    bg = args.get('bg', '09090b').replace('#','')
-    radius = args.get('borderRadius', '20').replace('px', '')
+    bg = sanitize_xml(args.get('bg', '09090b').replace('#',''))
+    radius = sanitize_xml(args.get('borderRadius', '20').replace('px', ''))
     
     # 1. Override animations for Compact (Server Mode) - Must happen before CSS gen
     if data['type'] == 'discord':
@@ -327,29 +1402,189 @@ def handler(key, mode="auto"):
         # Default style is compact, unless specifically overridden by URL
         if style == 'hyper': style = 'compact'
     
-    # 2. Generate AI msg
+    # Already rendered for this exact data + settings?
+    with METRICS.timer("badge_stage_seconds", timings, stage="output_cache"):
+        out_key = output_key(target_mode, style, args, data)
+        hit = CACHE.get("svg", out_key)
+    if hit: return (data['type'], *hit, True)
+
+    # 2. Images + AI msg, concurrently under one deadline
     ai_role = "roast" if roast else "hud"
-    msg = None
+    px = int(STYLE_IMAGE_BOX.get(style, 100) * IMAGE_SCALE)
+    jobs = {"avatar": (get_base64, (data['avatar_url'], px), EMPTY)}
+    if data['art_url']: jobs["art"] = (get_base64, (data['art_url'], px), EMPTY)
     if style != 'compact' and ai_on != 'false':
         ft = f"{data.get('l1','')} {data.get('l2','')}"
-        msg = consult_gemini(ft, data['name'], ai_role, ai_on)
+        jobs["ai"] = (consult_gemini, (ft, data['name'], ai_role, ai_on), (None, False))
+    res, complete = gather(jobs, started + REQUEST_DEADLINE, timings)
+    data['avatar'] = res['avatar']
+    if 'art' in res: data['album_art'] = res['art']
+    msg, fresh = res.get('ai', (None, True))
+    complete = complete and fresh
 
     # 3. Get CSS
-    css = get_css(anim_on, bg_an, fg_an)
+    with METRICS.timer("badge_stage_seconds", timings, stage="css"):
+        css = get_css(anim_on, bg_an, fg_an)
 
     # 4. RENDER
-    # ALL Styles now accept 5 arguments to match this signature:
+    # ALL Styles accept 5 arguments to match this signature:
     # func(data, msg, css, radius, bg)
-    if style == 'compact': svg = render_compact(data, msg, css, radius, bg)
-    elif style == 'chillax': svg = render_chillax(data, msg, css, radius, bg)
-    elif style == 'spotify': svg = render_spotify(data, msg, css, radius, bg)
-    elif style == 'easteregg': svg = render_easteregg(data, msg, css, radius, bg)
-    elif style == 'cute': svg = render_cute(data, msg, css, radius, bg)
-    elif style == 'terminal': svg = render_terminal(data, msg, css, radius, bg)
-    elif style == 'pro' or style == 'professional': svg = render_pro(data, msg, css, radius, bg)
-    else: svg = render_standard(data, msg, css, radius, bg)
-
-    return Response(svg, mimetype="image/svg+xml", headers={"Cache-Control": "no-cache, max-age=0"})
+    renderer = STYLES.get(style, render_standard)
+    with METRICS.timer("badge_stage_seconds", timings, stage="render"):
+        with METRICS.timer("badge_render_seconds", style=style if style in STYLES else "standard"):
+            svg = renderer(data, msg, css, radius, bg)
+    METRICS.observe("badge_response_bytes", len(svg), type=data['type'])
+
+    etag = hashlib.sha256(svg).hexdigest()
+    # Degraded renders (timed out avatar / AI, stand-in AI line) are served but not kept
+    img_saved = IMAGES.saved(data['avatar_url'], px) + IMAGES.saved(data['art_url'], px)
+    if complete: CACHE.set("svg", out_key, (svg, etag, img_saved), CACHE_POLICY.get(data['type'], (None,))[0])
+    return data['type'], svg, etag, img_saved, complete
+
+@app.route('/superbadge/<key>')
+@app.route('/badge/<mode>/<key>')
+def handler(key, mode="auto"):
+    badge = build_badge(key, mode, request.args, g.started, g.timings)
+    if not badge: return Response(ERROR_SVG, mimetype="image/svg+xml")
+    return svg_response(*badge)
+
+# ===========================
+#        BATCH BADGES
+# ===========================
+
+BATCH_POOL = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch")
+
+def parse_item(item):
+    """
+    'key', 'mode:key' or 'mode:key:style' (or the same as a dict) -> (mode, key, style).
+    Raises ValueError for anything else, including dict fields that are not strings or numbers.
+    """
+    if isinstance(item, dict):
+        fields = [item.get('mode') or 'auto', item.get('key', ''), item.get('style') or None]
+        if not all(f is None or (isinstance(f, (str, int)) and not isinstance(f, bool)) for f in fields):
+            raise ValueError("item fields must be strings")
+        return tuple(f if f is None else str(f) for f in fields)
+    if not isinstance(item, str): raise ValueError("items must be strings or objects")
+    parts = item.strip().split(':')
+    if len(parts) == 1: return 'auto', parts[0], None
+    return parts[0] or 'auto', parts[1], parts[2] if len(parts) > 2 else None
+
+def svg_size(svg):
+    head = svg[:svg.index(b'>')]
+    w = re.search(rb'\bwidth="(\d+)"', head)
+    h = re.search(rb'\bheight="(\d+)"', head)
+    return int(w.group(1)) if w else 480, int(h.group(1)) if h else 150
+
+def compose_grid(svgs, columns):
+    """
+    Lays badges out in one SVG.
+    Each badge keeps its own nested <svg>; its ids get a per-cell prefix so clip paths,
+    filters and patterns with the same name in two badges don't collide.
+    """
+    cells = []
+    for i, svg in enumerate(svgs):
+        prefix = f"b{i}-".encode()
+        svg = re.sub(rb'\bid="', b'id="' + prefix, svg)
+        svg = svg.replace(b'url(#', b'url(#' + prefix)
+        cells.append((svg_size(svg), svg))
+    cw = max((size[0] for size, _ in cells), default=0)
+    ch = max((size[1] for size, _ in cells), default=0)
+    columns = max(1, min(columns, len(cells) or 1))
+    rows = (len(cells) + columns - 1) // columns
+    width = columns * cw + (columns - 1) * BATCH_GAP
+    height = rows * ch + max(rows - 1, 0) * BATCH_GAP
+    out = [f'<svg width="{width}" height="{height}" viewBox="0 0 {width} {height}" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">'.encode()]
+    for i, (_, svg) in enumerate(cells):
+        x, y = (i % columns) * (cw + BATCH_GAP), (i // columns) * (ch + BATCH_GAP)
+        out.append(svg.replace(b'<svg ', f'<svg x="{x}" y="{y}" '.encode(), 1))
+    out.append(b'</svg>')
+    return b"".join(out)
+
+@app.route('/badges', methods=['GET', 'POST'])
+def batch():
+    """
+    Many badges in one round trip.
+    GET  /badges?items=user:ID:chillax,discord:CODE,github:torvalds&format=svg&columns=2 (+ shared badge params)
+    POST /badges {"items": ["user:ID", {"mode": "discord", "key": "CODE"}], "format": "json", "params": {...}}
+    Identical items are built once; Lanyard IDs in the batch join the presence subscription
+    together and upstream / image lookups are shared through the usual caches.
+    Each item gets the full REQUEST_DEADLINE from when a batch worker picks it up.
+    """
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        if body is None: body = {}
+        if not isinstance(body, dict): return jsonify(error="body must be a JSON object"), 400
+        items, params = body.get('items') or [], body.get('params') or {}
+        if not isinstance(items, list): return jsonify(error="items must be a list"), 400
+        if not isinstance(params, dict): return jsonify(error="params must be an object"), 400
+        params = MultiDict((k, str(v)) for k, v in params.items())
+        fmt, columns = body.get('format', 'svg'), body.get('columns', 2)
+    else:
+        items = [i for i in request.args.get('items', '').split(',') if i.strip()]
+        params = MultiDict((k, v) for k, v in request.args.items(multi=True) if k not in ('items', 'format', 'columns'))
+        fmt, columns = request.args.get('format', 'svg'), request.args.get('columns', 2)
+    try: columns = int(columns)
+    except (TypeError, ValueError): columns = 2
+
+    try: specs = list(dict.fromkeys(parse_item(i) for i in items[:BATCH_MAX]))
+    except ValueError as e: return jsonify(error=str(e)), 400
+    def build(spec):
+        mode, key, style = spec
+        args = params.copy()
+        if style: args['style'] = style
+        try: return build_badge(key, mode, args, time.time())
+        except Exception: return None
+    badges = dict(zip(specs, BATCH_POOL.map(build, specs)))
+
+    if fmt == 'json':
+        out = {}
+        for mode, key, style in specs:
+            badge = badges[(mode, key, style)]
+            name = ':'.join(p for p in (mode, key, style) if p)
+            out[name] = badge[1].decode() if badge else ERROR_SVG
+        return jsonify(out)
+
+    svgs = [badges[spec][1] if badges[spec] else ERROR_SVG.encode() for spec in specs]
+    svg = compose_grid(svgs, columns)
+    max_age = min((CACHE_POLICY.get(b[0], (0, 0))[0] if b[4] else 0 for b in badges.values() if b), default=0)
+    return Response(svg, mimetype="image/svg+xml", headers={"Cache-Control": f"public, max-age={max_age}"})
+
+@app.route('/stats')
+def stats():
+    return jsonify(cache=CACHE.snapshot(), pools=pool_stats(), images=IMAGES.stats, ai=AI.stats)
+
+# ===========================
+#      INSTRUMENTATION
+# ===========================
+
+METRICS.gauge("badge_presence_tracked", "Lanyard user IDs held by the presence subscription.",
+              lambda: [({}, len(PRESENCE.tracked()))])
+METRICS.counter("badge_ai_queue_total", "Gemini queue totals (calls, prompts, errors, dropped).",
+                lambda: [({"stat": k}, v) for k, v in AI.stats.items()])
+METRICS.counter("badge_image_store_total", "Image store totals (processed, bytes_downloaded, bytes_embedded as data URIs).",
+                lambda: [({"stat": k}, v) for k, v in IMAGES.stats.items()])
+METRICS.gauge("badge_pool_connections", "Upstream keep-alive connections per host.",
+              lambda: [({"host": host, "state": k}, v) for host, p in pool_stats().items() for k, v in p.items()])
+
+@app.before_request
+def start_timer():
+    g.started = time.time()
+    g.timings = {}
+
+@app.after_request
+def record_request(resp):
+    took = time.time() - g.started
+    endpoint = request.endpoint or "unknown"
+    METRICS.inc("badge_http_requests_total", endpoint=endpoint, code=resp.status_code)
+    METRICS.observe("badge_http_request_seconds", took, endpoint=endpoint)
+    if SERVER_TIMING and g.timings:
+        stages = [f"{stage};dur={t * 1000:.1f}" for stage, t in g.timings.items()]
+        resp.headers["Server-Timing"] = ", ".join(stages + [f"total;dur={took * 1000:.1f}"])
+    return resp
+
+@app.route('/metrics')
+def metrics():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
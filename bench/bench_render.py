@@ -0,0 +1,74 @@
+"""
+Micro-benchmarks, no network: sanitize_xml, get_css and every renderer (ops/sec).
+
+    python bench/bench_render.py [seconds_per_case]
+
+Works against older revisions of app.py too (falls back to the render_* functions
+when there is no STYLES registry), so numbers can be compared across commits.
+bench/run.py runs these as part of the full suite.
+"""
+import base64
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import app  # noqa: E402
+
+# ~30KB avatar, roughly what a 128px Discord PNG inlines to
+AVATAR = "data:image/png;base64," + base64.b64encode(os.urandom(22 * 1024)).decode()
+
+DATA = {
+    "type": "user", "name": "Zandy", "l1": "🎵 Blinding Lights", "l2": "By The Weeknd",
+    "color": "#1DB954", "avatar": AVATAR, "avatar_url": None,
+    "album_art": AVATAR, "art_url": None, "is_music": True, "progress": 42.0, "id": "1173155162093785099",
+}
+MSG = "SYSTEMS NOMINAL // CODING HARD"
+
+# Typical sanitize_xml inputs: plain names, emoji statuses, markup-heavy custom statuses
+TEXTS = {
+    "plain": "Visual Studio Code",
+    "emoji": "Night Coder 🌙 // 🎵 Blinding Lights",
+    "dirty": "shipping it <tonight> & \"not\" sleeping\x07\x1b 'ok'",
+}
+CSS_FLAGS = [(m, b, f) for m in ("true", "false") for b in ("true", "false") for f in ("true", "false")]
+
+def styles():
+    registry = getattr(app, "STYLES", None)
+    if registry: return {name: fn for name, fn in registry.items() if name != "professional"}
+    names = ["compact", "chillax", "spotify", "easteregg", "cute", "terminal", "pro"]
+    return {name: getattr(app, f"render_{name}") for name in names}
+
+def cases():
+    """name -> zero-argument callable doing one operation."""
+    out = {f"sanitize_xml/{name}": (lambda t=text: app.sanitize_xml(t)) for name, text in TEXTS.items()}
+    out["get_css"] = lambda: [app.get_css(*f) for f in CSS_FLAGS]
+    css = app.get_css("true", "true", "true")
+    for name, fn in dict(styles(), standard=app.render_standard).items():
+        def render(fn=fn):
+            svg = fn(dict(DATA), MSG, css, "20", "09090b")
+            if isinstance(svg, str): svg.encode()  # Older revisions left encoding to the response
+        out[f"render/{name}"] = render
+    return out
+
+def rate(fn, seconds):
+    """Calls fn in batches of 200 for about `seconds`, returns calls/sec."""
+    n, start = 0, time.perf_counter()
+    while True:
+        for _ in range(200): fn()
+        n += 200
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds: return n / elapsed
+
+def run(seconds=1.0):
+    """{case: ops/sec}; get_css counts all 8 flag combinations as one op."""
+    return {name: rate(fn, seconds) for name, fn in cases().items()}
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    print(f"{'case':<24}{'ops/sec':>14}")
+    for name, ops in run(seconds).items():
+        print(f"{name:<24}{ops:>14,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Offline benchmark suite: micro-benchmarks plus end-to-end load through the Flask app,
+with every upstream (Lanyard, Discord, GitHub, Gemini, image CDNs) replayed from
+bench/fixtures/ by a local stub server. Writes a JSON report to compare across commits.
+
+    python bench/run.py                          # full suite -> bench/results/<commit>.json
+    python bench/run.py --compare bench/results/<older>.json
+    python bench/run.py --only e2e --types user_spotify --styles chillax,compact
+
+End-to-end modes:
+    hot   same URL every time, served from the rendered badge cache
+    warm  unique query per request, full build with upstream / images / AI from cache
+    cold  every cache emptied before each request, everything refetched from the stub
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+import stub_server  # noqa: E402
+
+SPOTIFY_ID, GAME_ID = "1173155162093785099", "2841036829150273536"
+TYPES = {
+    "user_spotify": f"/badge/user/{SPOTIFY_ID}",
+    "user_game": f"/badge/user/{GAME_ID}",
+    "discord": "/badge/discord/DrfX6286kF",
+    "github": "/badge/github/torvalds",
+    "batch": f"/badges?items=user:{SPOTIFY_ID},user:{GAME_ID},discord:DrfX6286kF,github:torvalds/linux",
+}
+MODES = ("hot", "warm", "cold")
+WARMUP = 5
+
+def boot(latency_ms):
+    """Starts the stub and imports app wired to it (must run before anything imports app)."""
+    server = stub_server.start(latency_ms=latency_ms)
+    base = stub_server.url(server)
+    os.environ.update(CACHE_BACKEND="memory", GEMINI_API_KEY="bench", AI_RATE="1000",
+                      PRESENCE_WS_URL=stub_server.ws_url(server))
+    os.environ.pop("IMAGE_CACHE_DIR", None)
+    import app
+    for prefix in list(app.HTTP.adapters):
+        if prefix.startswith("https://"): app.HTTP.mount(prefix, stub_server.StubAdapter(base, pool_maxsize=32))
+    app.AI.model_factory = lambda: stub_server.StubGemini(app.HTTP, base)
+    return app, server
+
+def reset(app):
+    """Empties every in-process cache the request path reads."""
+    cache = app.CACHE
+    with cache.lock:
+        cache.data.clear()
+        cache.bytes = 0
+    with app.PRESENCE.lock: app.PRESENCE.presence.clear()
+
+def svg_lookups(app):
+    """(hits, misses) of the rendered badge cache so far."""
+    count = lambda result: app.METRICS.values.get(("badge_cache_requests_total", (("ns", "svg"), ("result", result), ("tier", "memory"))), 0)
+    return count("hit"), count("miss")
+
+def percentile(sorted_values, q):
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+def load(app, url, mode, requests, concurrency, case="load"):
+    """
+    Drives one URL through the WSGI app, returns req/s and latency percentiles (ms).
+    Warm nonces carry the case name, so no two cases of a run build the same output.
+    """
+    if mode == "cold": concurrency = 1  # Emptying shared caches mid-flight would time other threads' requests
+    sep = "&" if "?" in url else "?"
+    warm = mode == "warm"
+    client = app.app.test_client()
+    for i in range(WARMUP): client.get(f"{url}{sep}n={case}-w{i}" if warm else url)
+
+    counter = itertools.count()
+    latencies, errors, lock = [], [0], threading.Lock()
+    def worker():
+        client = app.app.test_client()
+        mine, failed = [], 0
+        while True:
+            i = next(counter)
+            if i >= requests: break
+            if mode == "cold": reset(app)
+            t = time.perf_counter()
+            r = client.get(f"{url}{sep}n={case}-{i}" if warm else url)
+            mine.append(time.perf_counter() - t)
+            if r.status_code != 200 or b"DATA API ERROR" in r.data: failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    hits, misses = svg_lookups(app)
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for th in threads: th.start()
+    for th in threads: th.join()
+    elapsed = time.perf_counter() - start
+    hits, misses = (now - before for now, before in zip(svg_lookups(app), (hits, misses)))
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 3)
+    return {
+        "requests": len(latencies), "concurrency": concurrency, "errors": errors[0],
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": ms(percentile(latencies, .50)), "p95_ms": ms(percentile(latencies, .95)),
+        "p99_ms": ms(percentile(latencies, .99)), "mean_ms": ms(sum(latencies) / max(len(latencies), 1)),
+        "svg_hit_rate": round(hits / max(hits + misses, 1), 3),
+    }
+
+def end_to_end(app, args):
+    styles = args.styles.split(",") if args.styles else ["hyper"] + [s for s in app.STYLES if s != "professional"]
+    types = args.types.split(",") if args.types else list(TYPES)
+    out = {}
+    for mode in args.modes.split(","):
+        n = args.cold_requests if mode == "cold" else args.requests
+        for badge_type in types:
+            for style in styles:
+                url = f"{TYPES[badge_type]}{'&' if '?' in TYPES[badge_type] else '?'}style={style}"
+                res = out[f"{mode}/{badge_type}/{style}"] = load(app, url, mode, n, args.concurrency, f"{badge_type}-{style}")
+                print(f"  {mode:<5} {badge_type:<13} {style:<10} {res['rps']:>9,.1f} req/s  "
+                      f"p50 {res['p50_ms']:>8.2f}  p95 {res['p95_ms']:>8.2f}  p99 {res['p99_ms']:>8.2f} ms  "
+                      f"svg hits {res['svg_hit_rate']:>4.0%}"
+                      + (f"  {res['errors']} errors" if res["errors"] else ""))
+    return out
+
+def git_commit():
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--", "app.py"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return (sha or "unknown") + ("-dirty" if dirty else "")
+    except OSError:
+        return "unknown"
+
+def compare(report, baseline_path, threshold):
+    """Prints every metric that moved more than threshold (fraction) against an older report."""
+    with open(baseline_path) as f: base = json.load(f)
+    rows = []
+    for name, ops in report.get("micro", {}).items():
+        old = base.get("micro", {}).get(name)
+        if old: rows.append((f"micro/{name}", "ops/s", old, ops, ops / old - 1))
+    for name, res in report.get("e2e", {}).items():
+        old = base.get("e2e", {}).get(name)
+        if not old: continue
+        rows.append((name, "req/s", old["rps"], res["rps"], res["rps"] / old["rps"] - 1))
+        # Latency going up is the regression, so flip its sign to match throughput
+        rows.append((name, "p99 ms", old["p99_ms"], res["p99_ms"], old["p99_ms"] / res["p99_ms"] - 1 if res["p99_ms"] else 0))
+    moved = [r for r in rows if abs(r[4]) >= threshold]
+    print(f"\nvs {base['meta']['commit']} ({len(rows)} metrics, {len(moved)} moved >= {threshold:.0%}):")
+    for name, unit, old, new, change in sorted(moved, key=lambda r: r[4]):
+        print(f"  {'REGRESSION' if change < 0 else 'improved  '} {name:<36} {unit:<7} {old:>12,.2f} -> {new:>12,.2f} ({change:+.1%})")
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--only", choices=("micro", "e2e"), help="Run just one half of the suite")
+    p.add_argument("--modes", default=",".join(MODES), help="Comma list of hot,warm,cold")
+    p.add_argument("--types", help=f"Comma list of badge types ({','.join(TYPES)}), default all")
+    p.add_argument("--styles", help="Comma list of styles, default every registered style")
+    p.add_argument("--requests", type=int, default=200, help="Requests per hot / warm case")
+    p.add_argument("--cold-requests", type=int, default=30, help="Requests per cold case")
+    p.add_argument("--concurrency", type=int, default=4, help="Client threads for hot / warm cases")
+    p.add_argument("--latency", type=float, default=0, help="Extra ms the stub waits per upstream call")
+    p.add_argument("--micro-seconds", type=float, default=0.5, help="Seconds per micro-benchmark")
+    p.add_argument("--out", help="Report path, default bench/results/<commit>.json")
+    p.add_argument("--compare", help="Older report to diff against")
+    p.add_argument("--threshold", type=float, default=0.10, help="Relative change reported by --compare")
+    args = p.parse_args()
+
+    app, server = boot(args.latency)
+    report = {"meta": {
+        "commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+    }}
+    if args.only != "e2e":
+        import bench_render
+        print("micro (ops/sec)")
+        report["micro"] = {name: round(ops, 1) for name, ops in bench_render.run(args.micro_seconds).items()}
+        for name, ops in report["micro"].items(): print(f"  {name:<24}{ops:>14,.0f}")
+    if args.only != "micro":
+        print("end-to-end")
+        report["e2e"] = end_to_end(app, args)
+        report["upstream_calls"] = dict(stub_server.StubHandler.counts)
+        report["presence_subscriptions"] = len(stub_server.StubHandler.subscriptions)
+    server.shutdown()
+
+    out = args.out or os.path.join(HERE, "results", f"{report['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f: json.dump(report, f, indent=2, sort_keys=True)
+    print(f"\nreport: {os.path.relpath(out)}")
+    if args.compare: compare(report, args.compare, args.threshold)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Local stand-in for every upstream the badge talks to, replaying bench/fixtures/.
+
+    python bench/stub_server.py [port] [latency_ms]
+
+Requests arrive as http://127.0.0.1:<port>/<original host>/<original path>
+(see StubAdapter, which rewrites the app's https:// calls onto this server).
+Images answer conditional requests with 304 like the real CDNs do, and
+/api.lanyard.rest/socket speaks enough of the Lanyard WebSocket protocol
+(hello, subscribe, INIT_STATE, PRESENCE_UPDATE via push()) for the presence tracker.
+"""
+import base64
+import hashlib
+import json
+import os
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from requests.adapters import HTTPAdapter
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def load(name, mode="r"):
+    with open(os.path.join(FIXTURES, name), mode) as f:
+        return json.load(f) if name.endswith(".json") else f.read()
+
+LANYARD = load("lanyard.json")
+INVITE = load("discord_invite.json")
+GITHUB_USER = load("github_user.json")
+GITHUB_REPO = load("github_repo.json")
+GEMINI = load("gemini.json")
+AVATAR = load("avatar.png", "rb")
+ART_640 = load("album_art_640.jpg", "rb")
+ART_300 = load("album_art_300.jpg", "rb")
+
+NOT_FOUND = {"message": "404: Not Found", "code": 0}
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+HEARTBEAT_MS = 30000
+
+def lanyard(user_id):
+    """
+    Recorded Lanyard payload with its timestamps moved to now: the song loops as if it
+    were playing live, so badges see a progress bar that moves like real traffic does.
+    """
+    hit = LANYARD.get(user_id)
+    if not hit: return None
+    hit = json.loads(json.dumps(hit))
+    spotify = hit["data"].get("spotify")
+    if spotify:
+        start, end = spotify["timestamps"]["start"], spotify["timestamps"]["end"]
+        now = int(time.time() * 1000)
+        shift = now - (now - start) % (end - start) - start
+        for ts in [spotify["timestamps"]] + [a.get("timestamps", {}) for a in hit["data"]["activities"] if a.get("id", "").startswith("spotify")]:
+            for k in ts: ts[k] += shift
+    return hit
+
+def gemini_reply(prompt):
+    """One recorded line, or one numbered line per request in a batched prompt."""
+    lines = GEMINI["lines"]
+    numbers = [int(n) for n in re.findall(r"^(\d+): ", prompt, re.M)]
+    text = "\n".join(f"{n}: {lines[n % len(lines)]}" for n in numbers) if numbers else lines[len(prompt) % len(lines)]
+    reply = json.loads(json.dumps(GEMINI["response"]))
+    reply["candidates"][0]["content"]["parts"][0]["text"] = text
+    return reply
+
+def route(host, path):
+    """(status, content type, body) for a GET, body is a dict for JSON."""
+    m = re.match(r"/v1/users/(\d+)$", path)
+    if host == "api.lanyard.rest" and m:
+        hit = lanyard(m.group(1))
+        return (200, "application/json", hit) if hit else (404, "application/json", {"success": False, "error": {"code": "user_not_monitored"}})
+    if host == "discord.com" and path.startswith("/api/v10/invites/"):
+        return 200, "application/json", INVITE
+    if host == "api.github.com" and re.match(r"/repos/[^/]+/[^/]+$", path):
+        return 200, "application/json", GITHUB_REPO
+    if host == "api.github.com" and path.startswith("/users/"):
+        return 200, "application/json", GITHUB_USER
+    if host in ("cdn.discordapp.com", "avatars.githubusercontent.com"):
+        return 200, "image/png", AVATAR
+    if host == "i.scdn.co":
+        return 200, "image/jpeg", ART_300 if "ab67616d00001e02" in path else ART_640
+    return 404, "application/json", NOT_FOUND
+
+class Socket:
+    """One accepted WebSocket: unmasked server frames out, masked client frames in."""
+    def __init__(self, conn, rfile):
+        self.conn = conn
+        self.rfile = rfile
+        self.lock = threading.Lock()
+        self.ids = []
+
+    def send(self, msg):
+        body = json.dumps(msg).encode()
+        n = len(body)
+        head = bytes([0x81, n]) if n < 126 else struct.pack("!BBH", 0x81, 126, n) if n < 65536 else struct.pack("!BBQ", 0x81, 127, n)
+        with self.lock: self.conn.sendall(head + body)
+
+    def _read(self, n):
+        buf = self.rfile.read(n)
+        if len(buf) < n: raise ConnectionError("closed")
+        return buf
+
+    def recv(self):
+        """(opcode, payload bytes)."""
+        b0, b1 = self._read(2)
+        n = b1 & 0x7f
+        if n == 126: n = struct.unpack("!H", self._read(2))[0]
+        elif n == 127: n = struct.unpack("!Q", self._read(8))[0]
+        mask = self._read(4) if b1 & 0x80 else b"\0\0\0\0"
+        data = self._read(n)
+        return b0 & 0x0f, bytes(c ^ mask[i % 4] for i, c in enumerate(data))
+
+def push(user_id, data):
+    """Sends a PRESENCE_UPDATE to every socket subscribed to user_id."""
+    for sock in list(StubHandler.sockets):
+        if user_id in sock.ids:
+            try: sock.send({"op": 0, "t": "PRESENCE_UPDATE", "seq": 1, "d": dict(data, user_id=user_id)})
+            except OSError: pass
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real upstreams
+    latency = 0.0
+    counts = {}
+    lock = threading.Lock()
+    sockets = []        # Open WebSockets
+    subscriptions = []  # Every subscribe_to_ids list received, in order
+
+    def log_message(self, *args): pass
+
+    def _target(self):
+        host, _, path = self.path.lstrip("/").partition("/")
+        with self.lock: self.counts[host] = self.counts.get(host, 0) + 1
+        if self.latency: time.sleep(self.latency)
+        return host, "/" + path.split("?", 1)[0]
+
+    def _send(self, status, ctype, body, headers=()):
+        if isinstance(body, dict): body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in headers: self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.headers.get("Upgrade", "").lower() == "websocket": return self._websocket()
+        status, ctype, body = route(*self._target())
+        if ctype.startswith("image/"):
+            etag = '"%s"' % hashlib.md5(body).hexdigest()
+            if self.headers.get("If-None-Match") == etag: return self._send(304, ctype, b"", [("ETag", etag)])
+            return self._send(status, ctype, body, [("ETag", etag), ("Cache-Control", "max-age=86400")])
+        self._send(status, ctype, body)
+
+    def _websocket(self):
+        host, path = self._target()
+        if (host, path) != ("api.lanyard.rest", "/socket"): return self._send(404, "application/json", NOT_FOUND)
+        accept = base64.b64encode(hashlib.sha1((self.headers["Sec-WebSocket-Key"] + WS_GUID).encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+        sock = Socket(self.connection, self.rfile)
+        self.sockets.append(sock)
+        try:
+            sock.send({"op": 1, "d": {"heartbeat_interval": HEARTBEAT_MS}})
+            while True:
+                opcode, payload = sock.recv()
+                if opcode == 8: break
+                if opcode == 9:
+                    with sock.lock: sock.conn.sendall(bytes([0x8a, len(payload)]) + payload)
+                    continue
+                msg = json.loads(payload or b"{}")
+                if msg.get("op") == 2:
+                    sock.ids = [str(i) for i in msg.get("d", {}).get("subscribe_to_ids", [])]
+                    with self.lock: self.subscriptions.append(list(sock.ids))
+                    state = {uid: lanyard(uid)["data"] for uid in sock.ids if uid in LANYARD}
+                    sock.send({"op": 0, "t": "INIT_STATE", "seq": 1, "d": state})
+        except (OSError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.sockets.remove(sock)
+            try: self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+
+    def do_POST(self):
+        host, path = self._target()
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if host != "generativelanguage.googleapis.com": return self._send(404, "application/json", NOT_FOUND)
+        prompt = "".join(p.get("text", "") for c in payload.get("contents", []) for p in c.get("parts", []))
+        self._send(200, "application/json", gemini_reply(prompt))
+
+def start(port=0, latency_ms=0):
+    """Starts the stub in a daemon thread, returns the server (base URL via url(server))."""
+    StubHandler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub", daemon=True).start()
+    return server
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def ws_url(server):
+    return f"ws://127.0.0.1:{server.server_address[1]}/api.lanyard.rest/socket"
+
+class StubAdapter(HTTPAdapter):
+    """Sends https://<host>/<path> to <base>/<host>/<path> instead."""
+    def __init__(self, base, **kwargs):
+        super().__init__(**kwargs)
+        self.base = base
+
+    def send(self, request, **kwargs):
+        request.url = f"{self.base}/{request.url.split('://', 1)[1]}"
+        return super().send(request, **kwargs)
+
+class StubGemini:
+    """generate_content() against the stub, shaped like genai.GenerativeModel."""
+    def __init__(self, session, base):
+        self.session = session
+        self.endpoint = f"{base}/generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent"
+
+    def generate_content(self, prompt):
+        r = self.session.post(self.endpoint, json={"contents": [{"parts": [{"text": prompt}]}]}, timeout=5)
+        r.raise_for_status()
+        text = r.json()["candidates"][0]["content"]["parts"][0]["text"]
+        return type("GenerateContentResponse", (), {"text": text})()
+
+if __name__ == "__main__":
+    server = start(int(sys.argv[1]) if len(sys.argv) > 1 else 8089, float(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    print(f"Serving fixtures on {url(server)}/<host>/<path>")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,129 @@
+"""
+AIQueue with a stub generate_content: dedupe, numbered batches, the last line while a
+fresh one is made, failures and token bucket pacing.
+
+    python -m pytest -q tests
+"""
+import os
+import re
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import app  # noqa: E402
+
+def wait_for(cond, timeout=5):
+    end = time.time() + timeout
+    while time.time() < end:
+        value = cond()
+        if value: return value
+        time.sleep(0.01)
+    raise AssertionError("timed out")
+
+def status(prompt):
+    return re.search(r"'([^']*)'\.", prompt).group(1)
+
+def echo(prompt, skip=()):
+    """One '<status> ok' line, or one numbered line per request in a batched prompt."""
+    numbered = re.findall(r"^(\d+): (.*)$", prompt, re.M)
+    if not numbered: return f"{status(prompt)} ok"
+    return "\n".join(f"{n}: {status(p)} ok" for n, p in numbered if int(n) not in skip)
+
+class StubModel:
+    """generate_content() answering with reply(prompt), held while `gate` is clear."""
+    def __init__(self, reply=echo):
+        self.reply = reply
+        self.prompts, self.times = [], []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def generate_content(self, prompt):
+        self.prompts.append(prompt)
+        self.times.append(time.monotonic())
+        self.gate.wait(5)
+        return type("GenerateContentResponse", (), {"text": self.reply(prompt)})()
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    cache = app.TTLCache(app.CACHE_TTL, 1000, 1 << 20)
+    monkeypatch.setattr(app, "CACHE", cache)
+    return cache
+
+def queue(model, rate=100, burst=5, batch=8):
+    return app.AIQueue(lambda: model, rate, burst, batch)
+
+def batched(q, model, asks):
+    """Holds the worker on a first prompt so `asks` queue up and go out as one batch."""
+    model.gate.clear()
+    q.ask("blocking", "first", "hud")
+    wait_for(lambda: q.inflight)
+    for args in asks: q.ask(*args)
+    pending = len(q.pending)
+    model.gate.set()
+    wait_for(lambda: len(model.prompts) == 2 and not q.inflight and not q.pending)
+    return pending
+
+def test_identical_prompts_are_generated_once():
+    model = StubModel()
+    q = queue(model)
+    asks = [("gaming", "zandy", "hud")] * 3 + [("gaming", "zandy", "roast"), ("coding", "bob", "hud")]
+    assert batched(q, model, asks) == 3
+    assert q.stats["prompts"] == 4 and q.stats["calls"] == 2
+    assert model.prompts[1].count("'gaming'") == 2  # hud and roast, once each
+    assert q.ask("gaming", "zandy", "hud") == ("GAMING OK", True)
+    assert q.ask("coding", "bob", "hud") == ("CODING OK", True)
+    assert len(model.prompts) == 2
+
+def test_batch_reply_with_missing_lines():
+    model = StubModel(lambda prompt: echo(prompt, skip={2}))
+    q = queue(model)
+    batched(q, model, [("gaming", "a", "hud"), ("coding", "b", "hud"), ("sleeping", "c", "hud")])
+    assert model.prompts[1].startswith("Answer each numbered request")
+    assert q.ask("gaming", "a", "hud") == ("GAMING OK", True)
+    assert q.ask("sleeping", "c", "hud") == ("SLEEPING OK", True)
+    # The unanswered line is a settled failure until AI_FAIL_TTL, not requeued
+    assert q.ask("coding", "b", "hud") == ("SECURE", True)
+    assert not q.pending and len(model.prompts) == 2
+
+def test_last_line_served_while_a_fresh_one_is_made():
+    model = StubModel()
+    q = queue(model)
+    assert q.ask("coding", "zandy", "hud", wait=2) == ("CODING OK", True)
+    model.gate.clear()
+    assert q.ask("gaming", "zandy", "hud", wait=2) == ("CODING OK", False)  # No waiting with a last line
+    model.gate.set()
+    wait_for(lambda: q.ask("gaming", "zandy", "hud")[1])
+    assert q.ask("gaming", "zandy", "hud") == ("GAMING OK", True)
+    assert q.ask("idle", "someone-else", "hud") == (None, False)
+
+def test_failure_returns_secure_and_is_remembered(cache):
+    def down(prompt): raise RuntimeError("quota exceeded")
+    model = StubModel(down)
+    q = queue(model)
+    assert q.ask("coding", "zandy", "hud", wait=2) == ("SECURE", True)
+    assert q.stats["errors"] == 1
+    assert q.ask("coding", "zandy", "hud") == ("SECURE", True)
+    assert len(model.prompts) == 1
+    # With a previous line, that line is the settled answer during the outage
+    cache.set("ai_last", "bob_hud", "STILL HERE")
+    assert q.ask("gaming", "bob", "hud") == ("STILL HERE", False)
+    wait_for(lambda: len(model.prompts) == 2 and not q.inflight)
+    assert q.ask("gaming", "bob", "hud") == ("STILL HERE", True)
+    assert cache.get("ai", "bob_gaming_hud") == ""
+
+def test_token_bucket_pacing():
+    bucket = app.TokenBucket(rate=20, burst=2)
+    start = time.monotonic()
+    for _ in range(2): bucket.take()
+    assert time.monotonic() - start < 0.03  # Burst
+    for _ in range(4): bucket.take()
+    assert 0.18 <= time.monotonic() - start < 1  # Then 20/s
+
+    model = StubModel()
+    q = queue(model, rate=20, burst=1, batch=1)
+    for name in "abcd": q.ask("coding", name, "hud")
+    wait_for(lambda: len(model.times) == 4)
+    assert min(b - a for a, b in zip(model.times, model.times[1:])) >= 0.04
@@ -0,0 +1,113 @@
+"""
+PresenceTracker against the local Lanyard stub (bench/stub_server.py): WebSocket
+subscribe / INIT_STATE, PRESENCE_UPDATE, resubscribe on new IDs, expiry, the
+REST polling fallback and which IDs get tracked at all.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+import app  # noqa: E402
+import stub_server  # noqa: E402
+
+SPOTIFY_ID, GAME_ID = "1173155162093785099", "2841036829150273536"
+
+def wait_for(cond, timeout=8):
+    end = time.time() + timeout
+    while time.time() < end:
+        value = cond()
+        if value: return value
+        time.sleep(0.05)
+    raise AssertionError("timed out")
+
+@pytest.fixture
+def stub():
+    server = stub_server.start()
+    del stub_server.StubHandler.subscriptions[:]
+    yield server
+    server.shutdown()
+
+@pytest.fixture
+def tracker(stub, monkeypatch):
+    monkeypatch.setattr(app, "PRESENCE_RESUBSCRIBE", 0.2)
+    tracker = app.PresenceTracker(stub_server.ws_url(stub))
+    yield tracker
+    with tracker.lock: tracker.seen.clear()  # Let the background thread go idle
+
+@pytest.mark.skipif(app.websocket is None, reason="websocket-client not installed")
+def test_subscribe_update_resubscribe_expire(tracker, monkeypatch):
+    subs = stub_server.StubHandler.subscriptions
+
+    # Untracked IDs are not followed, tracking subscribes and INIT_STATE fills the store
+    assert tracker.get(SPOTIFY_ID) is None
+    assert tracker.tracked() == []
+    tracker.track(SPOTIFY_ID)
+    d = wait_for(lambda: tracker.get(SPOTIFY_ID))
+    assert d["spotify"]["song"] == "Blinding Lights"
+    assert subs == [[SPOTIFY_ID]]
+
+    # PRESENCE_UPDATE replaces the stored payload
+    changed = dict(stub_server.LANYARD[SPOTIFY_ID]["data"], discord_status="idle", spotify=None)
+    stub_server.push(SPOTIFY_ID, changed)
+    wait_for(lambda: tracker.get(SPOTIFY_ID)["discord_status"] == "idle")
+
+    # A new ID resubscribes with the whole set
+    tracker.track(GAME_ID)
+    wait_for(lambda: tracker.get(GAME_ID))
+    assert sorted(subs[-1]) == sorted([SPOTIFY_ID, GAME_ID])
+
+    # IDs nobody asks for expire and the next subscription leaves them out
+    monkeypatch.setattr(app, "PRESENCE_IDLE", 0.5)
+    wait_for(lambda: tracker.get(GAME_ID) and subs[-1] == [GAME_ID])
+    assert tracker.tracked() == [GAME_ID]
+    assert SPOTIFY_ID not in tracker.presence
+
+def test_poll_uses_own_pool_and_cap(stub, monkeypatch):
+    session = app.make_session()
+    for prefix in list(session.adapters):
+        if prefix.startswith("https://"): session.mount(prefix, stub_server.StubAdapter(stub_server.url(stub)))
+    monkeypatch.setattr(app, "HTTP", session)
+    monkeypatch.setattr(app, "PRESENCE_POLL_MAX", 1)
+    tracker = app.PresenceTracker("ws://unused")
+    with tracker.lock: tracker.seen.update({SPOTIFY_ID: time.time() - 5, GAME_ID: time.time()})
+    monkeypatch.setattr(app.POOL, "submit", lambda *a, **k: pytest.fail("polled on the badge fan-out POOL"))
+
+    tracker._poll()
+    assert GAME_ID in tracker.presence  # Most recently requested
+    assert SPOTIFY_ID not in tracker.presence  # Over PRESENCE_POLL_MAX, left to per-request fetches
+
+def test_poll_interval_without_websocket_client(monkeypatch):
+    polls = []
+    def fetch_json(url, source):
+        polls.append(time.time())
+        return stub_server.lanyard(SPOTIFY_ID)
+    monkeypatch.setattr(app, "fetch_json", fetch_json)
+    monkeypatch.setattr(app, "websocket", None)
+    monkeypatch.setattr(app, "PRESENCE_POLL", 0.3)
+    tracker = app.PresenceTracker("ws://unused")
+    try:
+        tracker.track(SPOTIFY_ID)
+        wait_for(lambda: tracker.get(SPOTIFY_ID))
+        time.sleep(1.5)
+        assert 3 <= len(polls) <= 7  # One REST round per PRESENCE_POLL, not a busy loop
+        assert min(b - a for a, b in zip(polls, polls[1:])) >= 0.25
+    finally:
+        with tracker.lock: tracker.seen.clear()
+
+def test_fetch_data_tracks_only_known_users(monkeypatch):
+    tracker = app.PresenceTracker("ws://unused")
+    monkeypatch.setattr(app, "PRESENCE", tracker)
+    monkeypatch.setattr(app, "fetch_json", lambda url, service: stub_server.route("api.lanyard.rest", url.split("lanyard.rest", 1)[1])[2])
+    monkeypatch.setattr(app.PresenceTracker, "track", lambda self, uid: self.seen.__setitem__(uid, time.time()))
+    for junk in ("../../etc", "not-a-user", "12345", "9" * 19):
+        assert app.fetch_data(junk, "user", {}) is None
+    assert tracker.tracked() == []
+    app.fetch_data(SPOTIFY_ID, "user", {})
+    assert tracker.tracked() == [SPOTIFY_ID]